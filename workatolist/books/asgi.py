@@ -0,0 +1,83 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+READ_ROUTES = {'books-list', 'books-detail', 'authors-list', 'authors-detail'}
+READ_METHODS = ('GET', 'HEAD')
+
+
+def get_config():
+    return dict({'THREADS': 8, 'MAX_PENDING': 64, 'RETRY_AFTER': 1}, **getattr(settings, 'ASYNC_READS', {}))
+
+
+class ReadPool:
+    """Runs requests on a fixed number of threads, each one keeping its own DB connection, so there are never more
+    connections than threads. Up to max_pending requests wait for a thread, the pool is full past that"""
+
+    def __init__(self, threads, max_pending):
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='reads')
+        self.capacity = threads + max_pending
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def full(self):
+        return self.in_flight >= self.capacity
+
+    async def run(self, function, *args):
+        """Runs function on one of the threads, with a copy of the current context, and waits for its result"""
+        with self._lock:
+            self.in_flight += 1
+        # Counted until the function returns, even when the client gave up waiting for it
+        future = self.executor.submit(contextvars.copy_context().run, function, *args)
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+    def _done(self, future):
+        with self._lock:
+            self.in_flight -= 1
+
+
+class AsyncReadHandler(ASGIHandler):
+    """ASGI handler running GET and HEAD requests to the books and authors list and detail endpoints on a ReadPool,
+    while the event loop keeps accepting connections. When the pool is full, reads get a 503 with a Retry-After header
+    right away instead of queuing behind a slow DB. Other requests run like with the Django ASGIHandler"""
+
+    def __init__(self):
+        super().__init__()
+        config = get_config()
+        self.reads = ReadPool(config['THREADS'], config['MAX_PENDING'])
+        self.retry_after = config['RETRY_AFTER']
+
+    async def get_response(self, request):
+        if not self.is_read(request):
+            return await sync_to_async(super().get_response)(request)
+        if self.reads.full():
+            response = JsonResponse({'detail': 'Too many requests are waiting for the database, retry later.'},
+                                    status=503)
+            response['Retry-After'] = str(self.retry_after)
+            return response
+        return await self.reads.run(self.get_read_response, request)
+
+    def get_read_response(self, request):
+        try:
+            return super().get_response(request)
+        finally:
+            # request_finished closes the DB connections of the thread sending the response, not of this one
+            close_old_connections()
+
+    @staticmethod
+    def is_read(request):
+        if request.method not in READ_METHODS:
+            return False
+        try:
+            return resolve(request.path_info).url_name in READ_ROUTES
+        except Resolver404:
+            return False
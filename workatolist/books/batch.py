@@ -0,0 +1,159 @@
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from rest_framework import serializers, status
+
+from books.bulk import insert_books, replace_book_authors, update_books
+from books.cache import BOOKS_NAMESPACE, book_namespace, response_cache
+from books.changes import record_changes
+from books.models import Author, Book, BookChange
+from books.serializers import BookSerializer
+
+CREATE = 'create'
+UPDATE = 'update'
+DELETE = 'delete'
+
+ATOMIC = 'atomic'
+BEST_EFFORT = 'best_effort'
+
+
+class BatchSerializer(serializers.Serializer):
+    mode = serializers.ChoiceField(
+        [ATOMIC, BEST_EFFORT], default=ATOMIC,
+        help_text='`atomic` applies either every operation or none of them, `best_effort` applies the valid ones')
+    operations = serializers.ListField(
+        child=serializers.DictField(), allow_empty=False,
+        max_length=getattr(settings, 'BOOKS_BATCH_MAX_OPERATIONS', 1000))
+
+
+class OperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField([CREATE, UPDATE, DELETE])
+    id = serializers.IntegerField(required=False)
+    data = serializers.DictField(required=False)
+    partial = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if attrs['op'] != CREATE and 'id' not in attrs:
+            raise serializers.ValidationError({'id': 'This field is required.'})
+        if attrs['op'] != DELETE and 'data' not in attrs:
+            raise serializers.ValidationError({'data': 'This field is required.'})
+        return attrs
+
+
+class BookBatch:
+    """Validates and applies a list of book create, update and delete operations with a constant number of queries:
+    the books referenced are loaded with one query, their authors are checked with another one, and each kind of
+    operation is then applied with bulk statements"""
+
+    def __init__(self, operations, mode=ATOMIC):
+        self.operations = operations
+        self.mode = mode
+        self.results = [None] * len(operations)
+
+    @property
+    def failed(self):
+        return any(result['status'] >= 400 for result in self.results)
+
+    def _fail(self, index, status_code, errors):
+        self.results[index] = {'index': index, 'status': status_code, 'errors': errors}
+
+    def run(self):
+        envelopes = self._validate_envelopes()
+        books = Book.objects.in_bulk([operation['id'] for _, operation in envelopes if 'id' in operation])
+        known_author_ids = self._load_author_ids(envelopes)
+
+        creates, updates, deletes = [], [], []
+        referenced = set()
+        for index, operation in envelopes:
+            book_id = operation.get('id')
+            if operation['op'] != CREATE:
+                if book_id not in books:
+                    self._fail(index, status.HTTP_404_NOT_FOUND, {'detail': 'Not found.'})
+                    continue
+                if book_id in referenced:
+                    self._fail(index, status.HTTP_400_BAD_REQUEST, {'id': 'Book referenced twice in the batch.'})
+                    continue
+                referenced.add(book_id)
+
+            if operation['op'] == DELETE:
+                deletes.append((index, book_id))
+                continue
+
+            serializer = BookSerializer(
+                books.get(book_id), data=operation['data'], partial=operation['partial'],
+                context={'known_author_ids': known_author_ids})
+            if not serializer.is_valid():
+                self._fail(index, status.HTTP_400_BAD_REQUEST, serializer.errors)
+            elif operation['op'] == CREATE:
+                creates.append((index, serializer.validated_data))
+            else:
+                updates.append((index, books[book_id], serializer.validated_data))
+
+        if self.mode == ATOMIC and any(self.results):
+            for index, *_ in creates + updates + deletes:
+                self._fail(index, status.HTTP_424_FAILED_DEPENDENCY,
+                           {'detail': 'Not applied, other operations of the batch failed.'})
+            return self.results
+
+        try:
+            with transaction.atomic():
+                created, updated = self._apply(creates, updates, deletes)
+        except DatabaseError as e:
+            for index, *_ in creates + updates + deletes:
+                self._fail(index, status.HTTP_500_INTERNAL_SERVER_ERROR, {'detail': str(e)})
+            return self.results
+
+        touched = [book.id for _, book in created + updated] + [book_id for _, book_id in deletes]
+        response_cache.invalidate(BOOKS_NAMESPACE, *(book_namespace(book_id) for book_id in touched))
+        self._serialize_results(created, updated, deletes)
+        return self.results
+
+    def _validate_envelopes(self):
+        envelopes = []
+        for index, operation in enumerate(self.operations):
+            serializer = OperationSerializer(data=operation)
+            if serializer.is_valid():
+                envelopes.append((index, serializer.validated_data))
+            else:
+                self._fail(index, status.HTTP_400_BAD_REQUEST, serializer.errors)
+        return envelopes
+
+    @staticmethod
+    def _load_author_ids(envelopes):
+        """Returns which of the author ids referenced by the whole batch exist, with a single query"""
+        referenced = set()
+        for _, operation in envelopes:
+            authors = (operation.get('data') or {}).get('authors')
+            for author in authors if isinstance(authors, list) else []:
+                try:
+                    referenced.add(int(author['id']))
+                except (KeyError, TypeError, ValueError):
+                    pass
+        return set(Author.objects.filter(id__in=referenced).values_list('id', flat=True))
+
+    @staticmethod
+    def _apply(creates, updates, deletes):
+        created = [(index, Book(**{field: data[field] for field in data if field != 'authors'}), data)
+                   for index, data in creates]
+        insert_books([(book, [author['id'] for author in data['authors']]) for _, book, data in created])
+
+        for _, book, data in updates:
+            for field, value in data.items():
+                if field != 'authors':
+                    setattr(book, field, value)
+        update_books([book for _, book, _ in updates])
+        replace_book_authors(
+            (book.id, [author['id'] for author in data['authors']]) for _, book, data in updates if data.get('authors'))
+
+        Book.objects.filter(id__in=[book_id for _, book_id in deletes]).delete()
+        record_changes([book_id for _, book_id in deletes], BookChange.DELETED)
+        return [(index, book) for index, book, _ in created], [(index, book) for index, book, _ in updates]
+
+    def _serialize_results(self, created, updated, deletes):
+        """Renders the created and updated books with their authors, fetched with a single query"""
+        books = Book.objects.prefetch_related('authors').in_bulk([book.id for _, book in created + updated])
+        for status_code, results in ((status.HTTP_201_CREATED, created), (status.HTTP_200_OK, updated)):
+            for index, book in results:
+                self.results[index] = {
+                    'index': index, 'status': status_code, 'data': BookSerializer(books[book.id]).data}
+        for index, book_id in deletes:
+            self.results[index] = {'index': index, 'status': status.HTTP_204_NO_CONTENT}
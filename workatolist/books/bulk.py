@@ -0,0 +1,54 @@
+from django.db import connection
+from django.utils import timezone
+
+from books.changes import record_changes
+from books.models import Book, BookChange
+
+UPDATED_FIELDS = ('name', 'edition', 'publication_year')
+
+
+def insert_books(books):
+    """Inserts books along with their authors, given as (Book, author ids) pairs, with one statement for the books,
+    another one for the relation rows and a last one for the change feed"""
+    if connection.features.can_return_rows_from_bulk_insert:
+        Book.objects.bulk_create([book for book, _ in books])
+    else:
+        for book, _ in books:
+            book.save()
+    insert_book_authors((book.id, author_ids) for book, author_ids in books)
+    record_changes([book.id for book, _ in books], BookChange.CREATED)
+
+
+def update_books(books):
+    """Saves the UPDATED_FIELDS of the given books, touching their updated_at, with a single statement, and records the
+    changes with another one"""
+    now = timezone.now()
+    for book in books:
+        book.updated_at = now
+    Book.objects.bulk_update(books, UPDATED_FIELDS + ('updated_at',))
+    record_changes([book.id for book in books], BookChange.UPDATED)
+
+
+def replace_book_authors(book_authors):
+    """Sets the authors of every book, given as (book id, author ids) pairs. Only the relation rows that changed are
+    written, with at most one delete and one insert, so setting the same authors again writes nothing"""
+    wanted = {book_id: set(author_ids) for book_id, author_ids in book_authors}
+    BookAuthors = Book.authors.through
+    removed = []
+    for row_id, book_id, author_id in BookAuthors.objects.filter(book_id__in=wanted).values_list(
+            'id', 'book_id', 'author_id'):
+        if author_id in wanted[book_id]:
+            wanted[book_id].discard(author_id)
+        else:
+            removed.append(row_id)
+    if removed:
+        BookAuthors.objects.filter(id__in=removed).delete()
+    insert_book_authors(wanted.items())
+
+
+def insert_book_authors(book_authors):
+    BookAuthors = Book.authors.through
+    BookAuthors.objects.bulk_create([
+        BookAuthors(book_id=book_id, author_id=author_id)
+        for book_id, author_ids in book_authors for author_id in dict.fromkeys(author_ids)
+    ])
@@ -0,0 +1,204 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+
+BOOKS_NAMESPACE = 'books'
+AUTHORS_NAMESPACE = 'authors'
+
+
+def normalize_query_params(request, query_params):
+    """Returns the sorted non empty values of the given query params"""
+    return sorted((param, value) for param in query_params for value in request.query_params.getlist(param) if value)
+
+
+class BaseCacheBackend:
+    """Storage used by the response cache. Subclasses must be safe to use from several threads, and set shared when
+    every process reads and writes the same storage: otherwise invalidations only reach the process making them"""
+    shared = False
+
+    def get(self, key):
+        """Returns the value stored for key, or None if it is missing or expired"""
+        raise NotImplementedError
+
+    def set(self, key, value, timeout=None):
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class LocMemLRUBackend(BaseCacheBackend):
+    """Process local cache holding at most max_entries values. The least recently used entry is evicted first"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        expires_at = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {'entries': len(self._data), 'max_entries': self.max_entries, 'evictions': self.evictions}
+
+
+class DjangoCacheBackend(BaseCacheBackend):
+    """Stores the responses in one of the Django CACHES, e.g. the database, memcached or redis cache shared by every
+    worker"""
+
+    def __init__(self, alias='default'):
+        self.cache = caches[alias]
+        self.shared = not isinstance(self.cache, LocMemCache)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.cache.set(key, value, timeout)
+
+    def delete_many(self, keys):
+        self.cache.delete_many(keys)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class ResponseCache:
+    """Caches serialized response data under keys prefixed by the generation of a namespace, a random token drawn
+    when the namespace is first read. Invalidating a namespace just drops its generation, at once for any number of
+    namespaces, so every entry cached before is never read again and ends up evicted. Generations are kept in the
+    backend as well, a lost generation only means a spurious invalidation. With a backend that isn't shared, other
+    processes only stop serving invalidated responses when they expire"""
+
+    def __init__(self, backend, timeout=None):
+        self.backend = backend
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _generation(self, namespace):
+        key = 'generation:{}'.format(namespace)
+        generation = self.backend.get(key)
+        if generation is None:
+            generation = uuid.uuid4().hex
+            self.backend.set(key, generation)
+        return generation
+
+    def make_key(self, namespace, request, query_params, replica=False):
+        """Builds the cache key of a request from its path and the given query params only, so params the view
+        ignores and their order never split the cache. Responses read from a replica are kept apart, they may miss
+        writes the primary has, and clients pinned to the primary must see them"""
+        params = normalize_query_params(request, query_params)
+        digest = hashlib.sha1(repr((request.get_host(), request.path, params, replica)).encode()).hexdigest()
+        return 'response:{}:{}:{}'.format(namespace, self._generation(namespace), digest)
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, self.timeout)
+
+    def invalidate(self, *namespaces):
+        """Invalidates the namespaces right away and once more when the current transaction commits, so responses
+        cached from data read before the commit are dropped as well"""
+        keys = ['generation:{}'.format(namespace) for namespace in namespaces]
+
+        def drop():
+            self.backend.delete_many(keys)
+        drop()
+        transaction.on_commit(drop)
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        return dict(self.backend.stats(), hits=self.hits, misses=self.misses)
+
+
+def book_namespace(book_id):
+    return '{}:{}'.format(BOOKS_NAMESPACE, book_id)
+
+
+def invalidate_book(book_id):
+    """Drops the cached book detail and every cached book list"""
+    response_cache.invalidate(BOOKS_NAMESPACE, book_namespace(book_id))
+
+
+def invalidate_book_lists():
+    """Drops every cached book list, new books don't change the details of existing ones"""
+    response_cache.invalidate(BOOKS_NAMESPACE)
+
+
+def invalidate_authors():
+    response_cache.invalidate(AUTHORS_NAMESPACE)
+
+
+def process_local_warning():
+    """Returns the warning commands invalidating the cache show when the web workers don't see their invalidations,
+    None if they do"""
+    if response_cache.backend.shared:
+        return None
+    return ('The response cache is local to each process: web workers keep serving the responses they cached before '
+            'this command {}. Unset RESPONSE_CACHE_LOCAL to share the cache and invalidate them'.format(
+                'for up to {} seconds'.format(response_cache.timeout) if response_cache.timeout else 'until evicted'))
+
+
+def build_response_cache():
+    config = getattr(settings, 'RESPONSE_CACHE', {})
+    backend_class = import_string(config.get('BACKEND', 'books.cache.DjangoCacheBackend'))
+    return ResponseCache(backend_class(**config.get('OPTIONS', {})), timeout=config.get('TIMEOUT'))
+
+
+response_cache = SimpleLazyObject(build_response_cache)
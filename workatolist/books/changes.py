@@ -0,0 +1,93 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, Max, Min, Value
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from books.models import BookChange
+
+
+class ChangesExpired(Exception):
+    """The requested sequence was pruned, along with the changes after it, the client must sync the full list again"""
+
+
+def get_config():
+    return dict({'RETENTION_DAYS': 30}, **getattr(settings, 'BOOK_CHANGES', {}))
+
+
+# Whether no transaction still running can add entries before this one on PostgreSQL: it was recorded by a transaction
+# older than the oldest one running, or by the current one
+SETTLED = RawSQL(
+    'books_bookchange.txid < txid_snapshot_xmin(txid_current_snapshot()) '
+    'OR books_bookchange.txid = txid_current_if_assigned()', [], output_field=BooleanField())
+
+
+def record_changes(book_ids, operation):
+    """Appends an entry per book to the change feed, with a single statement. Call it in the transaction writing the
+    books, so the feed never lists a change that was rolled back"""
+    BookChange.objects.bulk_create([BookChange(book_id=book_id, operation=operation) for book_id in book_ids])
+
+
+def feed_order():
+    """Fields the feed is ordered by. Sequences are handed out before the transactions writing them commit, in any
+    order, so on PostgreSQL entries go by the id of their transaction, which a trigger records, and only the entries of
+    transactions older than any still running are served: the ones committed later all come after them. Other DBs
+    commit one transaction at a time, their entries go by sequence"""
+    return ('txid', 'id') if connection.vendor == 'postgresql' else ('id',)
+
+
+def settled_entries():
+    if connection.vendor == 'postgresql':
+        return BookChange.objects.annotate(settled=SETTLED)
+    return BookChange.objects.annotate(settled=Value(True, output_field=BooleanField()))
+
+
+def latest_sequence():
+    """Returns the sequence to sync from right after downloading the full list, the last entry no running transaction
+    can add entries before"""
+    entries = settled_entries().filter(settled=True).order_by(*('-{}'.format(field) for field in feed_order()))
+    return next(iter(entries.values_list('id', flat=True)[:1]), 0)
+
+
+def read_changes(since, limit):
+    """Returns up to limit entries recorded after the since sequence, in feed order, and whether there are more. The
+    page ends before the first entry a running transaction may still add entries before, and tells there are no more
+    for now, so clients sync again later instead of polling. Raises ChangesExpired when the since entry was pruned, a
+    since of 0 reads whatever is retained"""
+    order = feed_order()
+    entries = settled_entries().order_by(*order)
+    if since:
+        position = BookChange.objects.filter(id=since).values(*order).first()
+        if position is None:
+            raise ChangesExpired()
+        # Entries after the position, the first field filters through the index and the others break the ties
+        first, *ties = order
+        entries = entries.filter(**{'{}__gte'.format(first): position[first]}).exclude(
+            **{first: position[first]}, **{'{}__lte'.format(field): position[field] for field in ties})
+
+    page = []
+    for entry in entries[:limit + 1]:
+        if not entry.settled:
+            return page, False
+        if len(page) == limit:
+            return page, True
+        page.append(entry)
+    return page, False
+
+
+def prune_changes(days, batch_size=10000):
+    """Deletes the entries older than days, by batches of ids, returning how many were deleted. The latest entry is
+    always kept, so clients that synced up to it can go on"""
+    cutoff = timezone.now() - timedelta(days=days)
+    first = BookChange.objects.aggregate(first=Min('id'))['first']
+    last = BookChange.objects.filter(changed_at__lt=cutoff).aggregate(last=Max('id'))['last']
+    if last is None:
+        return 0
+    latest = latest_sequence()
+    deleted = 0
+    for start in range(first, last + 1, batch_size):
+        batch = BookChange.objects.filter(id__gte=start, id__lte=min(start + batch_size - 1, last))
+        deleted += batch.exclude(id=latest).delete()[0]
+    return deleted
@@ -0,0 +1,70 @@
+import csv
+import io
+import json
+import zlib
+from itertools import islice
+
+from books.representations import BOOK_VALUES, book_representations
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def iter_books(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields every book of the queryset as a dict, with its authors, keeping memory constant regardless of the
+    catalogue size: books are read through a server-side cursor and authors are fetched once per chunk of books"""
+    rows = queryset.prefetch_related(None).order_by('id').values(*BOOK_VALUES).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield from book_representations(chunk)
+
+
+def ndjson_lines(books):
+    for book in books:
+        yield json.dumps(book, ensure_ascii=False) + '\n'
+
+
+def csv_lines(books):
+    """Formats books as csv, author ids and names of each book are joined by `|`"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['id', 'name', 'edition', 'publication_year', 'author_ids', 'author_names'])
+    for book in books:
+        writer.writerow([
+            book['id'], book['name'], book['edition'], book['publication_year'],
+            '|'.join(str(author['id']) for author in book['authors']),
+            '|'.join(author['name'] for author in book['authors']),
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def iter_chunks(lines, size=64 * 1024):
+    """Groups lines into encoded chunks of roughly size bytes, writing many small pieces is way slower"""
+    buffer = []
+    buffered = 0
+    for line in lines:
+        buffer.append(line)
+        buffered += len(line)
+        if buffered >= size:
+            yield ''.join(buffer).encode()
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def gzip_chunks(chunks):
+    """Compresses the chunks as a gzip stream, flushing after each one so the client starts receiving data right away"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', ndjson_lines),
+    'csv': ('text/csv', csv_lines),
+}
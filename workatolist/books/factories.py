@@ -7,6 +7,8 @@ class AuthorFactory(factory.DjangoModelFactory):
     class Meta:
         model = Author
 
+    name = factory.Sequence(lambda number: 'Author {}'.format(number))
+
 
 class BookFactory(factory.DjangoModelFactory):
     class Meta:
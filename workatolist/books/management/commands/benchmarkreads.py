@@ -0,0 +1,55 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from books.models import Book
+from books.renderers import FastJSONRenderer
+from books.representations import BOOK_VALUES, book_representations
+from books.serializers import BookSerializer
+from books.views import BookViewSet
+
+
+def serializer_page(size):
+    books = list(BookViewSet.queryset.order_by('id')[:size])
+    return JSONRenderer().render(BookSerializer(books, many=True).data)
+
+
+def values_page(size):
+    rows = list(Book.objects.order_by('id').values(*BOOK_VALUES)[:size])
+    return FastJSONRenderer().render(book_representations(rows))
+
+
+def median_time(function, size, repeat):
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function(size)
+        timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings)
+
+
+class Command(BaseCommand):
+    help = 'Compare the time to build and render pages of books with BookSerializer and with the values() read path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='Page sizes to benchmark')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of runs per page size, the median is kept')
+
+    def handle(self, *args, **options):
+        """Each run covers the queries, building the data and rendering it as JSON, the whole list endpoint work but
+        pagination and HTTP. Both paths must render the very same bytes"""
+        if not Book.objects.exists():
+            raise CommandError('There are no books to benchmark, seed the DB with the seedbenchmark command first')
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be a positive number')
+
+        self.stdout.write('{:>10} {:>15} {:>15} {:>8}'.format('page size', 'serializer ms', 'values ms', 'speedup'))
+        for size in options['sizes']:
+            if serializer_page(size) != values_page(size):
+                raise CommandError('The values() read path renders a different page of {} books'.format(size))
+            serializer_time = median_time(serializer_page, size, options['repeat'])
+            values_time = median_time(values_page, size, options['repeat'])
+            self.stdout.write('{:>10} {:>15.2f} {:>15.2f} {:>7.1f}x'.format(
+                size, serializer_time * 1000, values_time * 1000, serializer_time / values_time))
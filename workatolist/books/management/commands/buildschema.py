@@ -0,0 +1,31 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.schema import get_config, schema_version, write_schema
+
+
+class Command(BaseCommand):
+    help = 'Build the OpenAPI schema served by /docs/ into the OPENAPI_SCHEMA_FILE, so web processes just read it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete the file instead, the web processes then build the schema themselves')
+
+    def handle(self, *args, **options):
+        """Run it at build time, with the VERSION of the release, or without one the file is stamped with the
+        fingerprint of the source. Processes of another version ignore the file and build the schema of their own
+        code"""
+        config = get_config()
+        if not config['FILE']:
+            raise CommandError('Set OPENAPI_SCHEMA_FILE to the path of the file to build the schema into')
+
+        if options['clear']:
+            if os.path.exists(config['FILE']):
+                os.remove(config['FILE'])
+                self.stdout.write('Deleted {}'.format(config['FILE']))
+            return
+
+        version = schema_version()
+        write_schema(config['FILE'], version)
+        self.stdout.write('Wrote the schema of version {!r} to {}'.format(version, config['FILE']))
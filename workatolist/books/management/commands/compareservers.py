@@ -0,0 +1,92 @@
+import json
+import random
+import shlex
+import socket
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from books.management.commands.replaybenchmark import Replayer, current_commit, generate_requests, summarize
+
+SERVERS = {
+    'wsgi': 'gunicorn --workers {workers} --bind {host}:{port} workatolist.wsgi',
+    'asgi': 'gunicorn --workers {workers} --worker-class uvicorn.workers.UvicornWorker --bind {host}:{port} '
+            'workatolist.asgi',
+}
+# The endpoints AsyncReadHandler serves from its thread pool
+READ_REQUESTS = {'books-list', 'books-list-by-author', 'books-detail', 'authors-list'}
+
+
+def wait_for_server(process, host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError('The server exited with code {}'.format(process.returncode))
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError('The server did not accept connections within {} seconds'.format(timeout))
+
+
+class Command(BaseCommand):
+    help = ('Compare the throughput and tail latency of the books and authors reads under WSGI and ASGI servers with '
+            'the same number of workers')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Number of worker processes of both servers')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 32, 128],
+                            help='Numbers of concurrent clients to run the requests with')
+        parser.add_argument('--generate', type=int, default=2000, help='Number of requests sent per run')
+        parser.add_argument('--warmup', type=int, default=100, help='Number of requests sent before measuring')
+        parser.add_argument('--timeout', type=float, default=30, help='Timeout of each request, in seconds')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed used to generate requests')
+        parser.add_argument('--host', default='127.0.0.1', help='Address the servers listen on')
+        parser.add_argument('--port', type=int, default=8765, help='Port the servers listen on')
+        for name, command in SERVERS.items():
+            parser.add_argument('--{}-command'.format(name), default=command,
+                                help='Command starting the {} server, {{workers}}, {{host}} and {{port}} are '
+                                     'replaced'.format(name.upper()))
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        """Starts each server in turn and replays the same generated reads against it, once per concurrency. Both
+        servers run with the settings of this process, on the same DB"""
+        if options['workers'] < 1 or min(options['concurrency']) < 1:
+            raise CommandError('--workers and --concurrency must be positive numbers')
+        requests_list = [
+            request for request in generate_requests(options['generate'], random.Random(options['seed']))
+            if request['name'] in READ_REQUESTS
+        ]
+        url = 'http://{}:{}'.format(options['host'], options['port'])
+
+        results = {'commit': current_commit(), 'workers': options['workers'], 'servers': {}}
+        self.stdout.write('{:<6} {:>11} {:>9} {:>9} {:>9} {:>9} {:>7} {:>7}'.format(
+            'server', 'concurrency', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors', '503s'))
+        for name in SERVERS:
+            command = options['{}_command'.format(name)].format(
+                workers=options['workers'], host=options['host'], port=options['port'])
+            results['servers'][name] = runs = {}
+            process = subprocess.Popen(shlex.split(command), cwd=settings.BASE_DIR)
+            try:
+                wait_for_server(process, options['host'], options['port'], timeout=30)
+                if options['warmup']:
+                    Replayer(url, options['concurrency'][0], options['timeout']).run(
+                        requests_list[:options['warmup']])
+                for concurrency in options['concurrency']:
+                    samples, elapsed = Replayer(url, concurrency, options['timeout']).run(requests_list)
+                    runs[concurrency] = total = summarize(samples, elapsed)['total']
+                    latency = total['latency_ms']
+                    self.stdout.write('{:<6} {:>11} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>7} {:>7}'.format(
+                        name, concurrency, total['throughput'], latency['p50'], latency['p95'], latency['p99'],
+                        total['errors'], total['statuses'].get('503', 0)))
+            finally:
+                process.terminate()
+                process.wait()
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
@@ -0,0 +1,45 @@
+import sys
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from books.export import EXPORT_FORMATS, gzip_chunks, iter_books, iter_chunks
+from books.models import Book, BookQuerySet
+
+
+class Command(BaseCommand):
+    help = 'Export books, with their authors, as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_path', type=str, help='File to write the books to, use - for stdout')
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson', dest='output_format',
+                            help='Output format')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip')
+        for field in BookQuerySet.filter_fields:
+            parser.add_argument('--{}'.format(field.replace('__', '-').replace('_', '-')), dest=field,
+                                help='Only export books matching the {} filter of /books'.format(field))
+
+    def handle(self, *args, **options):
+        """Streams the books straight from the DB cursor to the output, so memory stays flat with catalogue size"""
+        _, lines = EXPORT_FORMATS[options['output_format']]
+        try:
+            books = Book.objects.filter_by_params(options)
+        except ValidationError as e:
+            raise CommandError('; '.join(
+                '--{} {}'.format(field, ' '.join(messages)) for field, messages in e.message_dict.items()))
+        chunks = iter_chunks(lines(iter_books(books)))
+        if options['gzip']:
+            chunks = gzip_chunks(chunks)
+
+        output_path = options['output_path']
+        try:
+            output = sys.stdout.buffer if output_path == '-' else open(output_path, 'wb')
+        except OSError as e:
+            raise CommandError('Oops, there was a problem opening the output file - {}'.format(e))
+
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output_path != '-':
+                output.close()
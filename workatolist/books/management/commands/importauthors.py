@@ -1,25 +1,249 @@
 import csv
+import json
+import multiprocessing
+import os
+import time
+from itertools import islice
 
+import django
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
+from django.db import connections, transaction
 
+from books.cache import invalidate_authors, process_local_warning
 from books.models import Author
 
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def read_chunks(reader, chunk_size):
+    """Yields lists of raw csv rows holding at most chunk_size entries, so the file never has to fit in memory"""
+    while True:
+        rows = list(islice(reader, chunk_size))
+        if not rows:
+            return
+        yield rows
+
+
+def unique_names(rows):
+    """Normalizes the author names of a chunk, dropping blank and repeated entries while keeping the file order"""
+    return list(dict.fromkeys(name for name in (row['name'].strip() for row in rows) if name))
+
+
+def insert_names(names):
+    """Inserts a list of author names with a single statement. Names already in the DB are skipped by the unique
+    constraint on Author.name, which is what makes replaying a chunk after a crash harmless"""
+    Author.objects.bulk_create([Author(name=name) for name in names], ignore_conflicts=True)
+
+
+def read_checkpoint(checkpoint_path):
+    """Returns the content of the checkpoint file, or an empty dict when there is none"""
+    if not os.path.exists(checkpoint_path):
+        return {}
+    with open(checkpoint_path) as file:
+        return json.load(file)
+
+
+def write_checkpoint(checkpoint_path, checkpoint):
+    """Atomically replaces the checkpoint file, so a crash while writing it never leaves a truncated checkpoint"""
+    tmp_path = '{}.tmp'.format(checkpoint_path)
+    with open(tmp_path, 'w') as file:
+        json.dump(checkpoint, file)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def shard_file(file_path, shards):
+    """Splits the csv file into byte ranges that start and end on line boundaries. Returns the header line and the
+    list of non empty (start, end) ranges covering every data row"""
+    with open(file_path, 'rb') as file:
+        header = file.readline()
+        data_start = file.tell()
+        file_size = os.fstat(file.fileno()).st_size
+
+        boundaries = [data_start]
+        for shard in range(1, shards):
+            approximate = data_start + (file_size - data_start) * shard // shards
+            file.seek(max(approximate - 1, boundaries[-1]))
+            file.readline()
+            boundaries.append(min(max(file.tell(), boundaries[-1]), file_size))
+        boundaries.append(file_size)
+
+    ranges = [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+    return header.decode('utf-8-sig'), ranges
+
+
+def import_shard(file_path, header, start, end, chunk_size, checkpoint_path):
+    """Imports the rows between the start and end byte offsets of the file, committing every chunk. Runs inside a
+    worker process, with its own DB connection, and returns the shard throughput figures"""
+    started_at = time.monotonic()
+    file_size = os.path.getsize(file_path)
+    fieldnames = next(csv.reader([header]))
+
+    offset = start
+    checkpoint = read_checkpoint(checkpoint_path)
+    if checkpoint.get('file_size') == file_size and checkpoint.get('start') == start:
+        offset = checkpoint['offset']
+
+    rows = names = 0
+    with open(file_path, 'rb') as file:
+        file.seek(offset)
+        while offset < end:
+            lines = []
+            while offset < end and len(lines) < chunk_size:
+                line = file.readline()
+                if not line:
+                    offset = end
+                    break
+                offset += len(line)
+                lines.append(line.decode('utf-8'))
+
+            # Sorting keeps concurrent workers from locking the same unique index entries in opposite order
+            chunk_names = sorted(unique_names(csv.DictReader(lines, fieldnames=fieldnames)))
+            with transaction.atomic():
+                insert_names(chunk_names)
+            write_checkpoint(checkpoint_path, {'file_size': file_size, 'start': start, 'offset': offset})
+            rows += len(lines)
+            names += len(chunk_names)
+
+    return {'start': start, 'end': end, 'rows': rows, 'names': names, 'seconds': time.monotonic() - started_at}
+
+
+def setup_worker():
+    """Worker processes must never reuse the DB connections of the parent, each one of them opens its own"""
+    django.setup()
+    for connection in connections.all():
+        connection.connection = None
+
 
 class Command(BaseCommand):
     help = 'Import author list from .csv file'
 
     def add_arguments(self, parser):
         parser.add_argument('file_path', type=str, help='Provides the authors csv file path')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='Number of csv rows inserted per bulk statement')
+        parser.add_argument('--stream', action='store_true',
+                            help='Commit after every chunk and keep a checkpoint file, so an interrupted import can '
+                                 'be resumed by running the same command again')
+        parser.add_argument('--checkpoint', type=str,
+                            help='Checkpoint file used by --stream and --workers, defaults to <file_path>.checkpoint')
+        parser.add_argument('--workers', type=int,
+                            help='Splits the file in byte ranges imported in parallel by this many processes, each '
+                                 'one committing its own chunks. Implies --stream and requires one author per line')
 
-    @transaction.atomic
     def handle(self, *args, **options):
-        """Perform the operations to include authors into the DB. In case it fails, atomicity should rollback all the
-        changes made up to that point"""
+        """Perform the operations to include authors into the DB. By default the whole file is imported in a single
+        transaction, so in case it fails, atomicity should rollback all the changes made up to that point. Using
+        --stream every chunk is committed on its own and the import resumes from the last committed chunk"""
         try:
             file_path = options.get('file_path')
-            data = csv.DictReader(open(file_path))
-            for item in data:
-                Author.objects.get_or_create(name=item['name'])
+            chunk_size = options.get('chunk_size')
+            workers = options.get('workers')
+            if chunk_size < 1:
+                raise ValueError('--chunk-size must be a positive number')
+            if workers is not None and workers < 1:
+                raise ValueError('--workers must be a positive number')
+
+            checkpoint_path = options.get('checkpoint') or '{}.checkpoint'.format(file_path)
+            if workers:
+                self._parallel_import(file_path, chunk_size, checkpoint_path, workers)
+            elif options.get('stream'):
+                self._stream_import(file_path, chunk_size, checkpoint_path)
+            else:
+                with transaction.atomic():
+                    self._import(file_path, chunk_size)
+            invalidate_authors()
+            warning = process_local_warning()
+            if warning:
+                self.stderr.write(self.style.WARNING(warning))
         except Exception as e:
             raise CommandError('Oops, there was a problem processing your file - {}'.format(e))
+
+    def _import(self, file_path, chunk_size):
+        with open(file_path, newline='', encoding='utf-8-sig') as file:
+            progress = Progress(self.stdout)
+            for rows in read_chunks(csv.DictReader(file), chunk_size):
+                insert_names(unique_names(rows))
+                progress.update(len(rows))
+            progress.finish()
+
+    def _stream_import(self, file_path, chunk_size, checkpoint_path):
+        file_size = os.path.getsize(file_path)
+        done = self._read_checkpoint(checkpoint_path, file_size)
+
+        with open(file_path, newline='', encoding='utf-8-sig') as file:
+            reader = csv.DictReader(file)
+            if done:
+                self.stdout.write('Resuming import after row {}'.format(done))
+                for _ in islice(reader, done):
+                    pass
+
+            progress = Progress(self.stdout)
+            for rows in read_chunks(reader, chunk_size):
+                with transaction.atomic():
+                    insert_names(unique_names(rows))
+                invalidate_authors()
+                done += len(rows)
+                write_checkpoint(checkpoint_path, {'file_size': file_size, 'rows': done})
+                progress.update(len(rows))
+            progress.finish()
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+    def _read_checkpoint(self, checkpoint_path, file_size):
+        """Returns how many rows were already committed, ignoring checkpoints left behind by a different file"""
+        checkpoint = read_checkpoint(checkpoint_path)
+        if checkpoint and checkpoint.get('file_size') != file_size:
+            self.stderr.write('Ignoring checkpoint {}, it was created for a different file'.format(checkpoint_path))
+            return 0
+        return checkpoint.get('rows', 0)
+
+    def _parallel_import(self, file_path, chunk_size, checkpoint_path, workers):
+        """Imports every shard of the file in its own process. Duplicates across shards are reconciled by the unique
+        constraint on Author.name, so the merge step only has to sum up what every worker did"""
+        started_at = time.monotonic()
+        header, shards = shard_file(file_path, workers)
+        initial_count = Author.objects.count()
+
+        # Forked workers would otherwise inherit the sockets of the connections opened by this process
+        connections.close_all()
+        shard_args = [(file_path, header, start, end, chunk_size, '{}.{}'.format(checkpoint_path, index))
+                      for index, (start, end) in enumerate(shards)]
+        with multiprocessing.Pool(len(shards) or 1, initializer=setup_worker) as pool:
+            results = pool.starmap(import_shard, shard_args)
+
+        for index, result in enumerate(results, start=1):
+            self.stdout.write('Worker {}: bytes {}-{}, {} rows, {} unique names in {:.2f}s ({:.0f} rows/sec)'.format(
+                index, result['start'], result['end'], result['rows'], result['names'], result['seconds'],
+                result['rows'] / result['seconds'] if result['seconds'] else 0))
+
+        rows = sum(result['rows'] for result in results)
+        elapsed = time.monotonic() - started_at
+        self.stdout.write('Imported {} rows with {} workers in {:.2f}s ({:.0f} rows/sec), {} new authors'.format(
+            rows, len(results), elapsed, rows / elapsed if elapsed else 0, Author.objects.count() - initial_count))
+
+        for args in shard_args:
+            if os.path.exists(args[-1]):
+                os.remove(args[-1])
+
+
+class Progress:
+    """Reports how many rows were processed so far and the import throughput"""
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.rows = 0
+        self.started_at = time.monotonic()
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started_at
+        return self.rows / elapsed if elapsed else 0
+
+    def update(self, rows):
+        self.rows += rows
+        self.stdout.write('{} rows processed ({:.0f} rows/sec)'.format(self.rows, self.rate))
+
+    def finish(self):
+        self.stdout.write('Imported {} rows in {:.2f}s ({:.0f} rows/sec)'.format(
+            self.rows, time.monotonic() - self.started_at, self.rate))
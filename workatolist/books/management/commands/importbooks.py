@@ -0,0 +1,191 @@
+import csv
+import json
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from books.bulk import insert_books
+from books.cache import invalidate_book_lists, process_local_warning
+from books.models import Author, Book
+
+DEFAULT_BATCH_SIZE = 5000
+MAX_SMALL_INTEGER = 32767
+
+
+class RecordError(Exception):
+    """Raised for book records that can't be imported, the rest of the batch goes on"""
+
+
+def read_csv_records(file):
+    """Yields (line number, record) pairs. Authors come from the `authors` column, ids or names, or from the
+    `author_ids`/`author_names` columns written by exportbooks, all of them separated by `|`"""
+    reader = csv.DictReader(file)
+    for row in reader:
+        authors = []
+        for column in ('authors', 'author_ids', 'author_names'):
+            for value in (row.get(column) or '').split('|'):
+                value = value.strip()
+                if not value:
+                    continue
+                if column == 'author_ids' or (column == 'authors' and value.isdigit()):
+                    authors.append({'id': value})
+                else:
+                    authors.append({'name': value})
+        # When both ids and names of the same authors are given, ids are enough
+        if row.get('author_ids'):
+            authors = [author for author in authors if 'id' in author]
+        yield reader.line_num, dict(row, authors=authors)
+
+
+def read_jsonl_records(file):
+    """Yields (line number, record) pairs. Authors are a list of ids, names or objects with an `id` or a `name`"""
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, RecordError('invalid JSON - {}'.format(e))
+            continue
+        if not isinstance(record, dict):
+            yield line_number, RecordError('each line must be a JSON object')
+            continue
+        if not isinstance(record.get('authors') or [], list):
+            yield line_number, RecordError('authors must be a list')
+            continue
+        authors = []
+        for author in record.get('authors') or []:
+            if isinstance(author, dict):
+                authors.append({'id': author['id']} if author.get('id') is not None else {'name': author.get('name')})
+            elif isinstance(author, int):
+                authors.append({'id': author})
+            else:
+                authors.append({'name': author})
+        yield line_number, dict(record, authors=authors)
+
+
+READERS = {
+    'csv': read_csv_records,
+    'jsonl': read_jsonl_records,
+}
+
+
+class AuthorMap:
+    """Resolves author references with an in-memory map of every author, loaded with a single query"""
+
+    def __init__(self):
+        self.ids_by_name = dict(Author.objects.values_list('name', 'id'))
+        self.ids = set(self.ids_by_name.values())
+
+    def resolve(self, author):
+        if 'id' in author:
+            try:
+                author_id = int(author['id'])
+            except (TypeError, ValueError):
+                raise RecordError('invalid author id {!r}'.format(author['id']))
+            if author_id not in self.ids:
+                raise RecordError('author {} does not exist'.format(author_id))
+            return author_id
+
+        name = str(author.get('name') or '').strip()
+        if name not in self.ids_by_name:
+            raise RecordError('author {!r} does not exist'.format(name))
+        return self.ids_by_name[name]
+
+
+def positive_small_integer(record, field):
+    try:
+        value = int(record.get(field))
+    except (TypeError, ValueError):
+        raise RecordError('{} must be an integer'.format(field))
+    if not 0 <= value <= MAX_SMALL_INTEGER:
+        raise RecordError('{} must be between 0 and {}'.format(field, MAX_SMALL_INTEGER))
+    return value
+
+
+def build_book(record, author_map):
+    """Validates a record the same way BookSerializer does, returning the Book and the ids of its authors"""
+    if isinstance(record, RecordError):
+        raise record
+    name = str(record.get('name') or '').strip()
+    if not name:
+        raise RecordError('name is required')
+    if len(name) > Book._meta.get_field('name').max_length:
+        raise RecordError('name is too long')
+    if not record['authors']:
+        raise RecordError('at least one author is required')
+
+    book = Book(
+        name=name,
+        edition=positive_small_integer(record, 'edition'),
+        publication_year=positive_small_integer(record, 'publication_year'),
+    )
+    author_ids = list(dict.fromkeys(author_map.resolve(author) for author in record['authors']))
+    return book, author_ids
+
+
+class Command(BaseCommand):
+    help = 'Import books from a .csv or .jsonl file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file_path', type=str, help='Provides the books file path')
+        parser.add_argument('--format', choices=sorted(READERS), dest='input_format',
+                            help='Input format, guessed from the file extension by default')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Number of books inserted per transaction')
+
+    def handle(self, *args, **options):
+        """Imports the books batch by batch, each batch in its own transaction. Invalid records are reported and
+        skipped, and a batch failing in the DB is reported and rolled back without stopping the import"""
+        file_path = options['file_path']
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive number')
+        input_format = options['input_format'] or ('jsonl' if file_path.endswith(('.jsonl', '.ndjson')) else 'csv')
+
+        try:
+            file = open(file_path, newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError('Oops, there was a problem processing your file - {}'.format(e))
+
+        started_at = time.monotonic()
+        author_map = AuthorMap()
+        imported = rejected = 0
+        with file:
+            records = READERS[input_format](file)
+            for batch_number, batch in enumerate(iter(lambda: list(islice(records, batch_size)), []), start=1):
+                books, errors = self._build_batch(batch, author_map)
+                try:
+                    with transaction.atomic():
+                        insert_books(books)
+                except Exception as e:
+                    errors.append('batch failed, none of its {} valid books were imported - {}'.format(len(books), e))
+                    books = []
+                invalidate_book_lists()
+
+                imported += len(books)
+                rejected += len(batch) - len(books)
+                for error in errors:
+                    self.stderr.write('Batch {}: {}'.format(batch_number, error))
+                self.stdout.write('Batch {}: {} books imported, {} rejected'.format(
+                    batch_number, len(books), len(batch) - len(books)))
+
+        elapsed = time.monotonic() - started_at
+        self.stdout.write('Imported {} books, rejected {}, in {:.2f}s ({:.0f} books/sec)'.format(
+            imported, rejected, elapsed, imported / elapsed if elapsed else 0))
+        warning = process_local_warning()
+        if warning:
+            self.stderr.write(self.style.WARNING(warning))
+
+    @staticmethod
+    def _build_batch(batch, author_map):
+        books = []
+        errors = []
+        for line_number, record in batch:
+            try:
+                books.append(build_book(record, author_map))
+            except RecordError as e:
+                errors.append('line {}: {}'.format(line_number, e))
+        return books, errors
@@ -0,0 +1,108 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What each target imports, like a process of that kind before serving its first request or running its command
+TARGETS = {
+    'wsgi': 'from workatolist.wsgi import application; from django.urls import resolve; resolve("/books/")',
+    'asgi': 'from workatolist.asgi import application; from django.urls import resolve; resolve("/books/")',
+    'manage': 'import django; django.setup()',
+}
+# The RSS is read from /proc where available: the peak RSS of getrusage() survives exec(), the child would report the
+# one of this process
+SCRIPT = (
+    'import time; started_at = time.perf_counter()\n'
+    '{target}\n'
+    'import json, resource, sys\n'
+    'try:\n'
+    '    rss = int(open("/proc/self/statm").read().split()[1]) * resource.getpagesize()\n'
+    'except OSError:\n'
+    '    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)\n'
+    'json.dump({{"seconds": time.perf_counter() - started_at, "rss": rss}}, sys.stdout)\n'
+)
+
+
+def parse_importtime(output):
+    """Parses the `-X importtime` lines into (module, self, cumulative microseconds) tuples, in the order the imports
+    completed"""
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        entries.append((name.strip(), int(own), int(cumulative)))
+    return entries
+
+
+def package_totals(entries):
+    """Returns the (package, self microseconds, number of modules) of each top level package, the slowest first"""
+    totals = defaultdict(lambda: [0, 0])
+    for name, own, _ in entries:
+        totals[name.split('.')[0]][0] += own
+        totals[name.split('.')[0]][1] += 1
+    return sorted(((package, own, count) for package, (own, count) in totals.items()), key=lambda total: -total[1])
+
+
+def run_target(target, lean, importtime=False):
+    """Starts a new interpreter importing the target, returning its (measures, stderr)"""
+    env = dict(os.environ)
+    env.pop('LEAN_RUNTIME', None)
+    if lean:
+        env['LEAN_RUNTIME'] = 'True'
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [
+        '-c', SCRIPT.format(target=TARGETS[target])]
+    process = subprocess.run(command, cwd=settings.BASE_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    if process.returncode:
+        raise CommandError('The {} startup failed:\n{}'.format(target, process.stderr[-2000:]))
+    return json.loads(process.stdout.splitlines()[-1]), process.stderr
+
+
+class Command(BaseCommand):
+    help = 'Report the startup time, memory and import time per module of a web worker or manage.py process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=sorted(TARGETS), default='wsgi', help='Kind of process to start')
+        parser.add_argument('--lean', action='store_true', help='Start it with LEAN_RUNTIME set')
+        parser.add_argument('--compare', action='store_true',
+                            help='Start it both with and without LEAN_RUNTIME and report the difference')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of startups timed, the median is kept. Import times come from another one')
+        parser.add_argument('--top', type=int, default=20, help='Number of packages and modules listed')
+
+    def handle(self, *args, **options):
+        """Each startup runs in a new interpreter, the current process has already imported everything"""
+        if options['repeat'] < 1 or options['top'] < 0:
+            raise CommandError('--repeat must be a positive number and --top can\'t be negative')
+        modes = [False, True] if options['compare'] else [options['lean']]
+
+        medians = {}
+        for lean in modes:
+            runs = [run_target(options['target'], lean)[0] for _ in range(options['repeat'])]
+            medians[lean] = {key: statistics.median(run[key] for run in runs) for key in ('seconds', 'rss')}
+            _, stderr = run_target(options['target'], lean, importtime=True)
+            self._report(options['target'], lean, medians[lean], parse_importtime(stderr), options['top'])
+
+        if options['compare']:
+            full, lean = medians[False], medians[True]
+            self.stdout.write('LEAN_RUNTIME: {:+.0f} ms ({:+.0%}), {:+.1f} MB RSS ({:+.0%})'.format(
+                (lean['seconds'] - full['seconds']) * 1000, lean['seconds'] / full['seconds'] - 1,
+                (lean['rss'] - full['rss']) / 2 ** 20, lean['rss'] / full['rss'] - 1))
+
+    def _report(self, target, lean, median, entries, top):
+        self.stdout.write('{}{}: started in {:.0f} ms, {:.1f} MB RSS, {} modules imported'.format(
+            target, ' (LEAN_RUNTIME)' if lean else '', median['seconds'] * 1000, median['rss'] / 2 ** 20,
+            len(entries)))
+        self.stdout.write('{:<50} {:>10} {:>8}'.format('package', 'self ms', 'modules'))
+        for package, own, count in package_totals(entries)[:top]:
+            self.stdout.write('{:<50} {:>10.1f} {:>8}'.format(package[:50], own / 1000, count))
+        self.stdout.write('{:<50} {:>10} {:>8}'.format('module', 'total ms', 'self ms'))
+        for name, own, cumulative in sorted(entries, key=lambda entry: -entry[2])[:top]:
+            self.stdout.write('{:<50} {:>10.1f} {:>8.1f}'.format(name[:50], cumulative / 1000, own / 1000))
+        self.stdout.write('')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from books.profiling import get_config, make_token
+
+
+class Command(BaseCommand):
+    help = 'Print a token for the X-Profile-Token header, requests carrying it are profiled'
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_token())
+        self.stderr.write('Valid for {} seconds, on servers sharing this SECRET_KEY'.format(
+            get_config()['TOKEN_MAX_AGE']))
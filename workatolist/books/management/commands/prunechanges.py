@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from books.changes import get_config, prune_changes
+
+
+class Command(BaseCommand):
+    help = 'Delete the entries of the books change feed older than the retention period, run it daily'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=get_config()['RETENTION_DAYS'],
+                            help='Entries older than this many days are deleted')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Entries deleted per statement')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--days and --batch-size must be positive numbers')
+        deleted = prune_changes(options['days'], options['batch_size'])
+        self.stdout.write('Deleted {} changes older than {} days'.format(deleted, options['days']))
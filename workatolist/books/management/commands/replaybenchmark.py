@@ -0,0 +1,232 @@
+import json
+import math
+import random
+import re
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+
+from books.models import Author, Book
+
+
+def percentile(values, rank):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(rank / 100 * len(values)) - 1)]
+
+
+def endpoint_name(method, path):
+    """Groups requests by method and path, ignoring the query string and replacing ids by a placeholder"""
+    path = re.sub(r'/\d+(?=/|$)', '/{id}', path.split('?')[0])
+    return '{} {}'.format(method.upper(), path)
+
+
+def read_requests(file_path):
+    """Reads the recorded requests, one JSON object per line: `{"method": "GET", "path": "/books/?limit=10"}`, plus
+    an optional `body`, `headers` and a `name` used to group the results"""
+    recorded = []
+    with open(file_path) as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                request = None
+            if not isinstance(request, dict) or 'path' not in request:
+                raise CommandError('Invalid request on line {} of {}'.format(line_number, file_path))
+            request.setdefault('method', 'GET')
+            request.setdefault('name', endpoint_name(request['method'], request['path']))
+            recorded.append(request)
+    return recorded
+
+
+def generate_requests(total, rng):
+    """Builds a read-heavy mix of requests hitting the books and authors seeded in the DB"""
+    books = Book.objects.aggregate(first=Min('id'), last=Max('id'))
+    authors = Author.objects.aggregate(first=Min('id'), last=Max('id'))
+    if books['first'] is None or authors['first'] is None:
+        raise CommandError('There is nothing to benchmark, seed the DB with the seedbenchmark command first')
+
+    def book_id():
+        return rng.randint(books['first'], books['last'])
+
+    def author_id():
+        return rng.randint(authors['first'], authors['last'])
+
+    sample_names = list(Author.objects.filter(id__in=[author_id() for _ in range(100)]).values_list('name', flat=True))
+    sample_names = sample_names or list(Author.objects.values_list('name', flat=True)[:100])
+
+    templates = [
+        (40, 'books-list', lambda: '/books/?limit=10&offset={}'.format(rng.randint(0, 1000))),
+        (15, 'books-list-by-author', lambda: '/books/?authors={}'.format(author_id())),
+        (25, 'books-detail', lambda: '/books/{}/'.format(book_id())),
+        (10, 'authors-list', lambda: '/authors/?limit=10&offset={}'.format(rng.randint(0, 1000))),
+        (10, 'authors-autocomplete', lambda: '/authors/autocomplete/?q={}'.format(
+            rng.choice(sample_names)[:rng.randint(1, 4)])),
+    ]
+    weights = [weight for weight, _, _ in templates]
+    generated = []
+    for _ in range(total):
+        _, name, build_path = rng.choices(templates, weights)[0]
+        generated.append({'method': 'GET', 'path': build_path(), 'name': name})
+    return generated
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Replayer:
+    """Fires the requests at the server from a pool of threads, each one with its own keep-alive session"""
+
+    def __init__(self, base_url, concurrency, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def send(self, request):
+        started_at = time.perf_counter()
+        try:
+            response = self._session().request(
+                request['method'], self.base_url + request['path'], json=request.get('body'),
+                headers=request.get('headers'), timeout=self.timeout)
+            status, queries, size = response.status_code, response.headers.get('X-Query-Count'), len(response.content)
+        except requests.RequestException:
+            status, queries, size = None, None, 0
+        elapsed = time.perf_counter() - started_at
+        return request['name'], status, elapsed, int(queries) if queries is not None else None, size
+
+    def run(self, requests_list):
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            samples = list(executor.map(self.send, requests_list))
+        return samples, time.perf_counter() - started_at
+
+
+def summarize(samples, elapsed):
+    """Aggregates the samples per endpoint, latencies are in milliseconds"""
+    grouped = defaultdict(list)
+    for sample in samples:
+        grouped[sample[0]].append(sample)
+    grouped['total'] = samples
+
+    summary = {}
+    for name, endpoint_samples in sorted(grouped.items()):
+        latencies = sorted(sample[2] * 1000 for sample in endpoint_samples)
+        queries = [sample[3] for sample in endpoint_samples if sample[3] is not None]
+        statuses = defaultdict(int)
+        for sample in endpoint_samples:
+            statuses[str(sample[1]) if sample[1] else 'connection error'] += 1
+        summary[name] = {
+            'requests': len(endpoint_samples),
+            'errors': sum(1 for sample in endpoint_samples if not sample[1] or sample[1] >= 500),
+            'statuses': dict(statuses),
+            'throughput': len(endpoint_samples) / elapsed if elapsed else None,
+            'latency_ms': {
+                'mean': sum(latencies) / len(latencies),
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'max': latencies[-1],
+            },
+            'queries_per_request': sum(queries) / len(queries) if queries else None,
+            'bytes_per_request': sum(sample[4] for sample in endpoint_samples) / len(endpoint_samples),
+        }
+    return summary
+
+
+class Command(BaseCommand):
+    help = 'Replay recorded, or generated, requests against a running server and report throughput and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the server under test')
+        parser.add_argument('--requests-file', help='JSON lines file with the requests to replay')
+        parser.add_argument('--generate', type=int, default=1000,
+                            help='Number of requests generated from the DB content when no --requests-file is given')
+        parser.add_argument('--save-requests', help='Write the generated requests to this file, to replay them later')
+        parser.add_argument('--concurrency', type=int, default=8, help='Number of concurrent clients')
+        parser.add_argument('--repeat', type=int, default=1, help='Number of times the requests are replayed')
+        parser.add_argument('--warmup', type=int, default=0, help='Number of requests sent before measuring')
+        parser.add_argument('--timeout', type=float, default=30, help='Timeout of each request, in seconds')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed used to generate requests')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='Results file of a previous run to compare against')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['repeat'] < 1:
+            raise CommandError('--concurrency and --repeat must be positive numbers')
+
+        if options['requests_file']:
+            requests_list = read_requests(options['requests_file'])
+        else:
+            requests_list = generate_requests(options['generate'], random.Random(options['seed']))
+            if options['save_requests']:
+                with open(options['save_requests'], 'w') as file:
+                    file.writelines(json.dumps(request) + '\n' for request in requests_list)
+        if not requests_list:
+            raise CommandError('There are no requests to replay')
+
+        replayer = Replayer(options['url'], options['concurrency'], options['timeout'])
+        if options['warmup']:
+            replayer.run(requests_list[:options['warmup']])
+        samples, elapsed = replayer.run(requests_list * options['repeat'])
+
+        results = {
+            'commit': current_commit(),
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'url': options['url'],
+            'concurrency': options['concurrency'],
+            'elapsed': elapsed,
+            'endpoints': summarize(samples, elapsed),
+        }
+        self._report(results['endpoints'], self._load_baseline(options['compare']))
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+
+    @staticmethod
+    def _load_baseline(file_path):
+        if not file_path:
+            return {}
+        with open(file_path) as file:
+            return json.load(file)['endpoints']
+
+    def _report(self, endpoints, baseline):
+        header = '{:<40} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>8}'.format(
+            'endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries')
+        self.stdout.write(header)
+        for name, stats in endpoints.items():
+            latency = stats['latency_ms']
+            queries = stats['queries_per_request']
+            self.stdout.write('{:<40} {:>8} {:>7} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>8}'.format(
+                name[:40], stats['requests'], stats['errors'], stats['throughput'], latency['p50'], latency['p95'],
+                latency['p99'], '-' if queries is None else '{:.1f}'.format(queries)))
+            if name in baseline:
+                before = baseline[name]
+                self.stdout.write('{:<40} {:>8} {:>7} {:>+8.0%} {:>+9.0%} {:>+9.0%} {:>+9.0%}'.format(
+                    '  vs baseline', '', '', *(
+                        (now - then) / then if then else 0 for now, then in (
+                            (stats['throughput'], before['throughput']),
+                            (latency['p50'], before['latency_ms']['p50']),
+                            (latency['p95'], before['latency_ms']['p95']),
+                            (latency['p99'], before['latency_ms']['p99'])))))
@@ -0,0 +1,98 @@
+import random
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from faker import Faker
+
+from books.bulk import insert_books
+from books.cache import invalidate_authors, invalidate_book_lists, process_local_warning
+from books.factories import AuthorFactory, BookFactory
+from books.models import Author, Book
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+def parse_distribution(spec):
+    """Returns a function drawing the number of authors of a book, from a spec like `2` (always 2 authors), `1-4`
+    (uniformly between 1 and 4) or `zipf:2.0:10` (zipf distributed with exponent 2.0, at most 10 authors)"""
+    if re.fullmatch(r'\d+', spec):
+        count = int(spec)
+        return lambda rng: count
+    match = re.fullmatch(r'(\d+)-(\d+)', spec)
+    if match:
+        low, high = int(match.group(1)), int(match.group(2))
+        return lambda rng: rng.randint(low, high)
+    match = re.fullmatch(r'zipf:(\d+(?:\.\d+)?):(\d+)', spec)
+    if match:
+        exponent, highest = float(match.group(1)), int(match.group(2))
+        weights = [1 / rank ** exponent for rank in range(1, highest + 1)]
+        return lambda rng: rng.choices(range(1, highest + 1), weights)[0]
+    raise ValueError('invalid authors per book distribution {!r}'.format(spec))
+
+
+class Command(BaseCommand):
+    help = 'Seed the DB with a synthetic dataset of authors and books, for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=10000, help='Number of authors to create')
+        parser.add_argument('--books', type=int, default=100000, help='Number of books to create')
+        parser.add_argument('--authors-per-book', default='1-3',
+                            help='Distribution of authors per book: `N`, `MIN-MAX` or `zipf:EXPONENT:MAX`')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows inserted per statement')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed creates the same dataset')
+        parser.add_argument('--clear', action='store_true', help='Delete every book and author first')
+
+    def handle(self, *args, **options):
+        try:
+            draw_authors_count = parse_distribution(options['authors_per_book'])
+        except ValueError as e:
+            raise CommandError(e)
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive number')
+        rng = random.Random(options['seed'])
+        faker = Faker()
+        faker.seed_instance(options['seed'])
+
+        if options['clear']:
+            Book.objects.all().delete()
+            Author.objects.all().delete()
+
+        started_at = time.monotonic()
+        author_ids = self._seed_authors(options['authors'], options['batch_size'], faker)
+        if not author_ids and options['books']:
+            raise CommandError('Books need authors, seed some with --authors')
+        self._seed_books(options['books'], options['batch_size'], author_ids, draw_authors_count, rng, faker)
+
+        invalidate_authors()
+        invalidate_book_lists()
+        self.stdout.write('Seeded {} authors and {} books in {:.2f}s'.format(
+            options['authors'], options['books'], time.monotonic() - started_at))
+        warning = process_local_warning()
+        if warning:
+            self.stderr.write(self.style.WARNING(warning))
+
+    def _seed_authors(self, total, batch_size, faker):
+        """Creates the authors, returning the ids of every author in the DB. Names get a sequence number suffix,
+        so they stay unique and realistic for prefix searches"""
+        first = Author.objects.count()
+        for start in range(0, total, batch_size):
+            authors = [AuthorFactory.build(name='{} {}'.format(faker.name(), first + number))
+                       for number in range(start, min(start + batch_size, total))]
+            with transaction.atomic():
+                Author.objects.bulk_create(authors, ignore_conflicts=True)
+            self.stdout.write('{} authors created'.format(min(start + batch_size, total)))
+        return list(Author.objects.values_list('id', flat=True))
+
+    def _seed_books(self, total, batch_size, author_ids, draw_authors_count, rng, faker):
+        for start in range(0, total, batch_size):
+            books = []
+            for _ in range(start, min(start + batch_size, total)):
+                book = BookFactory.build(
+                    name=faker.catch_phrase(), edition=rng.randint(1, 10), publication_year=rng.randint(1900, 2020))
+                authors_count = min(draw_authors_count(rng), len(author_ids))
+                books.append((book, rng.sample(author_ids, authors_count)))
+            with transaction.atomic():
+                insert_books(books)
+            self.stdout.write('{} books created'.format(min(start + batch_size, total)))
@@ -0,0 +1,89 @@
+import glob
+import os
+import pstats
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.profiling import CPROFILE, EXTENSIONS, SAMPLING, get_config
+
+SORT_KEYS = ('own', 'cumulative')
+
+
+def pstats_hot_functions(file_paths, sort, limit):
+    """Merges the pstats files, returning the (own seconds, cumulative seconds, calls, function) rows of the top
+    functions"""
+    stats = pstats.Stats(*file_paths)
+    rows = []
+    for (file_name, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+        name = '{} ({}:{})'.format(function, os.path.basename(file_name), line) if line else function
+        rows.append((own, cumulative, calls, name))
+    rows.sort(key=lambda row: row[SORT_KEYS.index(sort)], reverse=True)
+    return rows[:limit]
+
+
+def collapsed_hot_functions(file_paths, sort, limit):
+    """Adds up the collapsed stacks, returning the total number of samples and the (own samples, cumulative samples,
+    function) rows of the top functions. Own samples are the ones where the function was running, cumulative ones
+    where it was anywhere in the stack"""
+    own = Counter()
+    cumulative = Counter()
+    total = 0
+    for file_path in file_paths:
+        with open(file_path) as file:
+            for line in file:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if not stack:
+                    continue
+                count = int(count)
+                frames = stack.split(';')
+                total += count
+                own[frames[-1]] += count
+                for frame in set(frames):
+                    cumulative[frame] += count
+    ranking = own if sort == 'own' else cumulative
+    rows = [(own[name], cumulative[name], name) for name, _ in ranking.most_common(limit)]
+    return total, rows
+
+
+class Command(BaseCommand):
+    help = 'Summarize the hottest functions of the request profiles, per route'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', help='Profiles directory, REQUEST_PROFILING DIRECTORY by default')
+        parser.add_argument('--route', action='append', help='Only summarize this route, can be repeated')
+        parser.add_argument('--sort', choices=SORT_KEYS, default='own',
+                            help='Rank functions by their own time or by their cumulative time')
+        parser.add_argument('--limit', type=int, default=20, help='Number of functions listed per route')
+
+    def handle(self, *args, **options):
+        directory = options['directory'] or get_config()['DIRECTORY']
+        if not os.path.isdir(directory):
+            raise CommandError('There are no profiles in {}'.format(directory))
+        routes = options['route'] or sorted(
+            entry for entry in os.listdir(directory) if os.path.isdir(os.path.join(directory, entry)))
+
+        for route in routes:
+            for mode, extension in sorted(EXTENSIONS.items()):
+                file_paths = sorted(glob.glob(os.path.join(directory, route, '*' + extension)))
+                if not file_paths:
+                    continue
+                if mode == CPROFILE:
+                    self._write_pstats(route, file_paths, options['sort'], options['limit'])
+                elif mode == SAMPLING:
+                    self._write_collapsed(route, file_paths, options['sort'], options['limit'])
+
+    def _write_pstats(self, route, file_paths, sort, limit):
+        self.stdout.write('{}: {} cProfile profiles'.format(route, len(file_paths)))
+        self.stdout.write('  {:>10} {:>10} {:>10}  {}'.format('own s', 'cum s', 'calls', 'function'))
+        for own, cumulative, calls, name in pstats_hot_functions(file_paths, sort, limit):
+            self.stdout.write('  {:>10.4f} {:>10.4f} {:>10}  {}'.format(own, cumulative, calls, name))
+
+    def _write_collapsed(self, route, file_paths, sort, limit):
+        total, rows = collapsed_hot_functions(file_paths, sort, limit)
+        self.stdout.write('{}: {} sampled profiles, {} samples'.format(route, len(file_paths), total))
+        self.stdout.write('  {:>10} {:>10}  {}'.format('own %', 'cum %', 'function'))
+        for own, cumulative, name in rows:
+            self.stdout.write('  {:>10.1%} {:>10.1%}  {}'.format(own / total, cumulative / total, name))
+        if not total:
+            self.stdout.write('  no samples, requests faster than the SAMPLING_INTERVAL are better profiled by cProfile')
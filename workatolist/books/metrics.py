@@ -0,0 +1,261 @@
+import contextvars
+import glob
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from books.cache import response_cache
+
+PREFIX = 'workatolist'
+
+SECONDS_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Histograms observed for every request, labelled by route and method: name -> (help, buckets)
+HISTOGRAMS = {
+    'request_duration_seconds': ('Time spent handling the request', SECONDS_BUCKETS),
+    'db_duration_seconds': ('Time spent running SQL queries', SECONDS_BUCKETS),
+    'db_queries': ('Number of SQL queries run', QUERIES_BUCKETS),
+    'serialize_duration_seconds': ('Time spent serializing, SQL excluded', SECONDS_BUCKETS),
+    'render_duration_seconds': ('Time spent rendering the response, SQL excluded', SECONDS_BUCKETS),
+    'response_size_bytes': ('Size of the response body, streaming responses excluded', BYTES_BUCKETS),
+}
+
+# Response cache statistics, summed over the workers: stats key -> (metric name, type, help)
+RESPONSE_CACHE_STATS = {
+    'hits': ('response_cache_hits_total', 'counter', 'Responses served from the response cache'),
+    'misses': ('response_cache_misses_total', 'counter', 'Cacheable responses missing from the response cache'),
+    'evictions': ('response_cache_evictions_total', 'counter', 'Entries evicted from a full response cache'),
+    'entries': ('response_cache_entries', 'gauge', 'Entries held by the response cache'),
+}
+
+current_request = contextvars.ContextVar('current_request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Measurements of the request being handled. Phases are timed exclusive of the SQL run during them, so the
+    Server-Timing entries add up"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.phases = {}
+        self.render_started = None
+
+    def execute(self, execute, sql, params, many, context):
+        """DB execute wrapper, installed on every connection while the request is handled"""
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started_at
+            self.queries += 1
+
+    def start_phase(self):
+        return time.perf_counter(), self.db_time
+
+    def end_phase(self, name, started):
+        started_at, db_time = started
+        elapsed = time.perf_counter() - started_at - (self.db_time - db_time)
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+
+@contextmanager
+def measure(phase):
+    """Adds the time spent in the block to the given phase of the current request, if it is instrumented"""
+    request_metrics = current_request.get()
+    if request_metrics is None:
+        yield
+        return
+    started = request_metrics.start_phase()
+    try:
+        yield
+    finally:
+        request_metrics.end_phase(phase, started)
+
+
+class Registry:
+    """Per process histograms and response counters, snapshotted along with the response cache stats. Histograms are
+    stored as [sum, count of each bucket..., count above the last bucket], so snapshots of several workers merge by
+    adding them up"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.responses = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, method, status_code, values):
+        with self._lock:
+            for name, value in values.items():
+                if value is None:
+                    continue
+                key = (name, route, method)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = [0.0] * (len(HISTOGRAMS[name][1]) + 2)
+                histogram[0] += value
+                histogram[bisect_left(HISTOGRAMS[name][1], value) + 1] += 1
+            key = (route, method, str(status_code))
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'histograms': [list(key) + [histogram] for key, histogram in self.histograms.items()],
+                'responses': [list(key) + [count] for key, count in self.responses.items()],
+                'response_cache': response_cache.stats(),
+            }
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+            self.responses.clear()
+
+
+def merge_snapshots(snapshots):
+    histograms = {}
+    responses = {}
+    cache_stats = {}
+    for snapshot in snapshots:
+        for name, route, method, histogram in snapshot['histograms']:
+            if name not in HISTOGRAMS:
+                continue
+            merged = histograms.setdefault((name, route, method), [0.0] * len(histogram))
+            for index, value in enumerate(histogram):
+                merged[index] += value
+        for route, method, status_code, count in snapshot['responses']:
+            key = (route, method, status_code)
+            responses[key] = responses.get(key, 0) + count
+        for name, value in snapshot.get('response_cache', {}).items():
+            if name in RESPONSE_CACHE_STATS:
+                cache_stats[name] = cache_stats.get(name, 0) + value
+    return histograms, responses, cache_stats
+
+
+class FileStore:
+    """Shares the metrics of every worker through a directory: each process writes a snapshot of its registry to its
+    own file, at most once per flush interval, and reads of /metrics merge all of them. Files of workers that are gone
+    are kept, so counters never go backwards; wipe the directory when deploying"""
+
+    def __init__(self, directory, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._next_flush = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self):
+        return os.path.join(self.directory, 'metrics-{}.json'.format(os.getpid()))
+
+    def maybe_flush(self, registry):
+        if time.monotonic() >= self._next_flush:
+            self.flush(registry)
+
+    def flush(self, registry):
+        self._next_flush = time.monotonic() + self.flush_interval
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'w') as file:
+            json.dump(registry.snapshot(), file)
+        os.replace(temporary_path, self._path())
+
+    def collect(self, registry):
+        self.flush(registry)
+        snapshots = []
+        for file_path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                with open(file_path) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+
+class LocalStore:
+    """Metrics of the current process only, enough for a single worker"""
+
+    def maybe_flush(self, registry):
+        pass
+
+    def collect(self, registry):
+        return [registry.snapshot()]
+
+
+class Metrics:
+    def __init__(self, store):
+        self.registry = Registry()
+        self.store = store
+
+    def observe(self, route, method, status_code, values):
+        self.registry.observe(route, method, status_code, values)
+        self.store.maybe_flush(self.registry)
+
+    def clear(self):
+        self.registry.clear()
+
+    def render(self):
+        """Returns the merged metrics in the Prometheus text exposition format"""
+        histograms, responses, cache_stats = merge_snapshots(self.store.collect(self.registry))
+        lines = []
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            metric = '{}_{}'.format(PREFIX, name)
+            lines += ['# HELP {} {}'.format(metric, help_text), '# TYPE {} histogram'.format(metric)]
+            for (histogram_name, route, method), histogram in sorted(histograms.items()):
+                if histogram_name != name:
+                    continue
+                labels = 'route="{}",method="{}"'.format(escape_label(route), escape_label(method))
+                cumulative = 0
+                for bucket, count in zip(buckets + ('+Inf',), histogram[1:]):
+                    cumulative += count
+                    lines.append('{}_bucket{{{},le="{}"}} {:.0f}'.format(metric, labels, bucket, cumulative))
+                lines.append('{}_sum{{{}}} {!r}'.format(metric, labels, histogram[0]))
+                lines.append('{}_count{{{}}} {:.0f}'.format(metric, labels, cumulative))
+
+        metric = '{}_responses_total'.format(PREFIX)
+        lines += ['# HELP {} Responses sent'.format(metric), '# TYPE {} counter'.format(metric)]
+        for (route, method, status_code), count in sorted(responses.items()):
+            lines.append('{}{{route="{}",method="{}",status="{}"}} {}'.format(
+                metric, escape_label(route), escape_label(method), status_code, count))
+
+        for name, (metric_name, metric_type, help_text) in RESPONSE_CACHE_STATS.items():
+            if name not in cache_stats:
+                continue
+            metric = '{}_{}'.format(PREFIX, metric_name)
+            lines += ['# HELP {} {}'.format(metric, help_text), '# TYPE {} {}'.format(metric, metric_type),
+                      '{} {}'.format(metric, cache_stats[name])]
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def get_config():
+    return dict({'ENABLED': True, 'SERVER_TIMING': True, 'MULTIPROCESS_DIR': None, 'FLUSH_INTERVAL': 5, 'TOKEN': None},
+                **getattr(settings, 'REQUEST_METRICS', {}))
+
+
+def is_authorized(request, token):
+    """Whether the request may see the metrics: DEBUG is on, or it sends the token in an `Authorization: Bearer`
+    header"""
+    if settings.DEBUG:
+        return True
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and hmac.compare_digest(header.encode(), 'Bearer {}'.format(token).encode())
+
+
+def build_metrics():
+    config = get_config()
+    if config['MULTIPROCESS_DIR']:
+        return Metrics(FileStore(config['MULTIPROCESS_DIR'], config['FLUSH_INTERVAL']))
+    return Metrics(LocalStore())
+
+
+metrics = SimpleLazyObject(build_metrics)
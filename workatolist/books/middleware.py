@@ -0,0 +1,152 @@
+import os
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import InterfaceError, OperationalError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+from books import profiling, routers
+from books.metrics import RequestMetrics, current_request, get_config, is_authorized, metrics
+
+
+class InstrumentationMiddleware:
+    """Measures the SQL queries, serialization, rendering and size of every response. The timings are aggregated per
+    route in the histograms served by /metrics, and sent back in the Server-Timing header to the requests authorized
+    to see the metrics. The number of queries is also sent in the X-Query-Count header when the QUERY_COUNT_HEADER
+    setting is on, for the replaybenchmark command.
+
+    Keep it first in MIDDLEWARE, so it measures the whole request and its process_template_response runs right before
+    the response is rendered"""
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.server_timing = config['SERVER_TIMING']
+        self.token = config['TOKEN']
+        self.query_count_header = getattr(settings, 'QUERY_COUNT_HEADER', False)
+
+    def __call__(self, request):
+        request_metrics = RequestMetrics()
+        token = current_request.set(request_metrics)
+        started_at = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(request_metrics.execute))
+                response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        duration = time.perf_counter() - started_at
+
+        if request_metrics.render_started is not None:
+            request_metrics.end_phase('render', request_metrics.render_started)
+        resolver_match = getattr(request, 'resolver_match', None)
+        route = resolver_match.view_name if resolver_match else 'unmatched'
+        metrics.observe(route, request.method, response.status_code, {
+            'request_duration_seconds': duration,
+            'db_duration_seconds': request_metrics.db_time,
+            'db_queries': request_metrics.queries,
+            'serialize_duration_seconds': request_metrics.phases.get('serialize'),
+            'render_duration_seconds': request_metrics.phases.get('render'),
+            'response_size_bytes': None if response.streaming else len(response.content),
+        })
+
+        if self.server_timing and is_authorized(request, self.token):
+            response['Server-Timing'] = self._server_timing(request_metrics, duration)
+        if self.query_count_header:
+            response['X-Query-Count'] = str(request_metrics.queries)
+        return response
+
+    def process_template_response(self, request, response):
+        request_metrics = current_request.get()
+        if request_metrics is not None:
+            request_metrics.render_started = request_metrics.start_phase()
+        return response
+
+    @staticmethod
+    def _server_timing(request_metrics, duration):
+        entries = ['db;dur={:.2f};desc="{} queries"'.format(request_metrics.db_time * 1000, request_metrics.queries)]
+        entries += ['{};dur={:.2f}'.format(name, elapsed * 1000) for name, elapsed in request_metrics.phases.items()]
+        entries.append('total;dur={:.2f}'.format(duration * 1000))
+        return ', '.join(entries)
+
+
+class ProfilingMiddleware:
+    """Profiles a random SAMPLE_RATE fraction of the requests, and the requests carrying a valid X-Profile-Token header
+    (see the profiletoken command), writing each profile to a file under a directory named after the route. The path
+    of the file is sent back in the X-Profile header. Only enabled by the REQUEST_PROFILING setting"""
+
+    def __init__(self, get_response):
+        config = profiling.get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed()
+        if config['MODE'] not in profiling.PROFILERS:
+            raise ImproperlyConfigured(
+                'REQUEST_PROFILING MODE must be one of: {}'.format(', '.join(profiling.PROFILERS)))
+        self.get_response = get_response
+        self.config = config
+
+    def __call__(self, request):
+        if not self._should_profile(request):
+            return self.get_response(request)
+
+        profiler = profiling.PROFILERS[self.config['MODE']](self.config['SAMPLING_INTERVAL'])
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        route = resolver_match.view_name if resolver_match else 'unmatched'
+        file_path = profiling.profile_path(self.config['DIRECTORY'], route, self.config['MODE'])
+        profiler.save(file_path)
+        response['X-Profile'] = os.path.relpath(file_path, self.config['DIRECTORY'])
+        return response
+
+    def _should_profile(self, request):
+        token = request.META.get('HTTP_X_PROFILE_TOKEN')
+        if token is not None:
+            return profiling.check_token(token, self.config['TOKEN_MAX_AGE'])
+        return random.random() < self.config['SAMPLE_RATE']
+
+
+class ReplicaRoutingMiddleware:
+    """Sends the reads of GET, HEAD and OPTIONS requests to one of the DATABASE_REPLICAS, see books.routers. Requests
+    that write get a cookie back pinning the reads of that client to the primary for PIN_SECONDS, so it sees its own
+    writes despite the replication lag. A replica failing a request is left out until its next health check"""
+    pin_cookie = 'read_primary'
+
+    def __init__(self, get_response):
+        config = routers.get_config()
+        if not config['ENABLED'] or not config['ALIASES']:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.pool = routers.ReplicaPool(
+            config['ALIASES'], config['SELECTION'], config['HEALTH_CHECK_INTERVAL'], config['MAX_LAG'])
+        self.pin_seconds = config['PIN_SECONDS']
+
+    def __call__(self, request):
+        alias = None
+        if request.method in SAFE_METHODS and self.pin_cookie not in request.COOKIES:
+            alias = self.pool.choose()
+        routing = routers.Routing(alias)
+        token = routers.current_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.current_routing.reset(token)
+
+        if routing.wrote:
+            response.set_cookie(self.pin_cookie, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+        return response
+
+    def process_exception(self, request, exception):
+        routing = routers.current_routing.get()
+        if routing is not None and routing.alias and isinstance(exception, (InterfaceError, OperationalError)):
+            self.pool.mark_down(routing.alias)
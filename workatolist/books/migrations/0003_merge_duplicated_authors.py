@@ -0,0 +1,31 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicated_authors(apps, schema_editor):
+    """Keeps the oldest author of every repeated name, moving the books of the duplicates to it"""
+    Author = apps.get_model('books', 'Author')
+    BookAuthors = apps.get_model('books', 'Book').authors.through
+
+    duplicated = Author.objects.values('name').annotate(keep_id=Min('id'), total=Count('id')).filter(total__gt=1)
+    for entry in duplicated:
+        duplicate_ids = list(
+            Author.objects.filter(name=entry['name']).exclude(id=entry['keep_id']).values_list('id', flat=True))
+        for book_author in BookAuthors.objects.filter(author_id__in=duplicate_ids).order_by('id'):
+            if BookAuthors.objects.filter(author_id=entry['keep_id'], book_id=book_author.book_id).exists():
+                book_author.delete()
+            else:
+                book_author.author_id = entry['keep_id']
+                book_author.save()
+        Author.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0002_auto_20200330_2211'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicated_authors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_merge_duplicated_authors'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='author',
+            name='name',
+            field=models.CharField(help_text='Author name', max_length=200, unique=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+# Both indexes are built on the expression Django uses for the istartswith/icontains lookups on PostgreSQL
+CREATE_INDEXES = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS books_author_name_upper_like '
+    'ON books_author (UPPER(name::text) text_pattern_ops)',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS books_author_name_upper_trgm '
+    'ON books_author USING gin (UPPER(name::text) gin_trgm_ops)',
+]
+
+DROP_INDEXES = [
+    'DROP INDEX CONCURRENTLY IF EXISTS books_author_name_upper_like',
+    'DROP INDEX CONCURRENTLY IF EXISTS books_author_name_upper_trgm',
+]
+
+
+def run_on_postgresql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('books', '0004_author_name_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_postgresql(CREATE_INDEXES), run_on_postgresql(DROP_INDEXES)),
+    ]
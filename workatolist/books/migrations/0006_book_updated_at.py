@@ -0,0 +1,19 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_author_name_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now,
+                                       help_text='Last time the book, or its authors list, changed'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,63 @@
+from django.db import migrations, models
+
+INDEXES = [
+    models.Index(fields=['publication_year', 'id'], name='books_book_year_id_idx'),
+    models.Index(fields=['edition', 'publication_year'], name='books_book_edition_year_idx'),
+    models.Index(fields=['name', 'id'], name='books_book_name_id_idx'),
+]
+
+# The prefix index is built on the expression Django uses for the istartswith lookup on PostgreSQL, and the authors one
+# answers the books of an author subquery from the index alone
+CREATE_POSTGRESQL_INDEXES = [
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS books_book_name_upper_like '
+    'ON books_book (UPPER(name::text) text_pattern_ops)',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS books_book_authors_author_book '
+    'ON books_book_authors (author_id, book_id)',
+]
+
+DROP_POSTGRESQL_INDEXES = [
+    'DROP INDEX CONCURRENTLY IF EXISTS books_book_name_upper_like',
+    'DROP INDEX CONCURRENTLY IF EXISTS books_book_authors_author_book',
+]
+
+
+def create_indexes(apps, schema_editor):
+    """Builds the indexes without locking writes to the books on PostgreSQL"""
+    model = apps.get_model('books', 'Book')
+    postgresql = schema_editor.connection.vendor == 'postgresql'
+    for index in INDEXES:
+        if postgresql:
+            schema_editor.add_index(model, index, concurrently=True)
+        else:
+            schema_editor.add_index(model, index)
+    if postgresql:
+        for statement in CREATE_POSTGRESQL_INDEXES:
+            schema_editor.execute(statement)
+
+
+def drop_indexes(apps, schema_editor):
+    model = apps.get_model('books', 'Book')
+    postgresql = schema_editor.connection.vendor == 'postgresql'
+    for index in INDEXES:
+        if postgresql:
+            schema_editor.remove_index(model, index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, index)
+    if postgresql:
+        for statement in DROP_POSTGRESQL_INDEXES:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('books', '0006_book_updated_at'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(create_indexes, drop_indexes)],
+            state_operations=[migrations.AddIndex(model_name='book', index=index) for index in INDEXES],
+        ),
+    ]
@@ -0,0 +1,57 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+BACKFILL_BATCH_SIZE = 10000
+
+# The built-in trigger keeps search_vector in sync with the name on every insert and update, including bulk loads and
+# COPY, so no code path can forget about it. It must use the same configuration as books.models.SEARCH_CONFIG
+CREATE_TRIGGER = (
+    'CREATE TRIGGER books_book_search_vector_update BEFORE INSERT OR UPDATE OF name, search_vector ON books_book '
+    "FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger(search_vector, 'pg_catalog.english', name)"
+)
+BACKFILL = "UPDATE books_book SET search_vector = to_tsvector('pg_catalog.english', name) WHERE id >= %s AND id < %s"
+CREATE_INDEX = (
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS books_book_search_vector_gin ON books_book USING gin (search_vector)'
+)
+
+DROP_INDEX = 'DROP INDEX CONCURRENTLY IF EXISTS books_book_search_vector_gin'
+DROP_TRIGGER = 'DROP TRIGGER IF EXISTS books_book_search_vector_update ON books_book'
+
+
+def create_search_index(apps, schema_editor):
+    """Creates the trigger first, so books written during the backfill are indexed too. The backfill goes by batches of
+    ids, each one in its own transaction, so it doesn't lock the whole table"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(CREATE_TRIGGER)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT MIN(id), MAX(id) FROM books_book')
+        first, last = cursor.fetchone()
+        for start in range(first or 0, (last or 0) + 1, BACKFILL_BATCH_SIZE):
+            cursor.execute(BACKFILL, [start, start + BACKFILL_BATCH_SIZE])
+    schema_editor.execute(CREATE_INDEX)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(DROP_INDEX)
+    schema_editor.execute(DROP_TRIGGER)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('books', '0007_book_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, help_text='Words of the name, maintained by a trigger on PostgreSQL', null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_book_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('book_id', models.IntegerField(help_text='Id of the book changed')),
+                ('operation', models.CharField(
+                    choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')],
+                    help_text='What happened to the book', max_length=7)),
+                ('changed_at', models.DateTimeField(auto_now_add=True, help_text='Time the change was recorded')),
+            ],
+        ),
+    ]
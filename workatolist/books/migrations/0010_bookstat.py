@@ -0,0 +1,111 @@
+from django.db import migrations, models
+
+# Adds the books of each year/edition/author to books_bookstat, SUM(delta) of them once per write statement, thanks to
+# the transition tables of statement level triggers. Upserts go in key order so concurrent writers don't deadlock
+UPSERT = (
+    'INSERT INTO books_bookstat (dimension, value, books) '
+    'SELECT dimension, value, SUM(delta) FROM ({changes}) changes '
+    'GROUP BY dimension, value HAVING SUM(delta) <> 0 ORDER BY dimension, value '
+    'ON CONFLICT (dimension, value) DO UPDATE SET books = books_bookstat.books + EXCLUDED.books'
+)
+BOOK_ROWS = (
+    "SELECT 'year' AS dimension, publication_year AS value, {delta} AS delta FROM {rows} "
+    "UNION ALL SELECT 'edition', edition, {delta} FROM {rows}"
+)
+AUTHOR_ROWS = "SELECT 'author' AS dimension, author_id AS value, {delta} AS delta FROM {rows}"
+
+
+def trigger_function(name, rows):
+    inserted = rows.format(delta=1, rows='new_rows')
+    deleted = rows.format(delta=-1, rows='old_rows')
+    return (
+        'CREATE FUNCTION {name}() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN '
+        "IF TG_OP = 'INSERT' THEN {insert}; "
+        "ELSIF TG_OP = 'DELETE' THEN {delete}; "
+        "ELSE {update}; END IF; "
+        'RETURN NULL; END $$'
+    ).format(
+        name=name,
+        insert=UPSERT.format(changes=inserted),
+        delete=UPSERT.format(changes=deleted),
+        update=UPSERT.format(changes='{} UNION ALL {}'.format(inserted, deleted)),
+    )
+
+
+# Transition tables can't be shared by several events, hence one trigger per event
+TRIGGER = (
+    'CREATE TRIGGER {table}_stats_{event} AFTER {event} ON {table} REFERENCING {transition} '
+    'FOR EACH STATEMENT EXECUTE PROCEDURE {function}()'
+)
+TRANSITIONS = {
+    'insert': 'NEW TABLE AS new_rows',
+    'delete': 'OLD TABLE AS old_rows',
+    'update': 'OLD TABLE AS old_rows NEW TABLE AS new_rows',
+}
+TABLES = [
+    ('books_book', 'books_bookstat_count_books', BOOK_ROWS, ('insert', 'update', 'delete')),
+    ('books_book_authors', 'books_bookstat_count_authors', AUTHOR_ROWS, ('insert', 'delete')),
+]
+BACKFILL = [
+    "INSERT INTO books_bookstat (dimension, value, books) "
+    "SELECT 'year', publication_year, COUNT(*) FROM books_book GROUP BY publication_year",
+    "INSERT INTO books_bookstat (dimension, value, books) "
+    "SELECT 'edition', edition, COUNT(*) FROM books_book GROUP BY edition",
+    "INSERT INTO books_bookstat (dimension, value, books) "
+    "SELECT 'author', author_id, COUNT(*) FROM books_book_authors GROUP BY author_id",
+]
+
+
+def create_stats_triggers(apps, schema_editor):
+    """Creates the triggers before counting the existing books, in the same transaction: creating them locks the
+    tables against writes until the migration commits, so no book is counted twice or missed"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, function, rows, events in TABLES:
+        schema_editor.execute(trigger_function(function, rows))
+        for event in events:
+            schema_editor.execute(TRIGGER.format(
+                table=table, event=event, transition=TRANSITIONS[event], function=function))
+    for statement in BACKFILL:
+        schema_editor.execute(statement)
+
+
+def drop_stats_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, function, _, events in TABLES:
+        for event in events:
+            schema_editor.execute('DROP TRIGGER IF EXISTS {table}_stats_{event} ON {table}'.format(
+                table=table, event=event))
+        schema_editor.execute('DROP FUNCTION IF EXISTS {}()'.format(function))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_bookchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(
+                    choices=[('year', 'Publication year'), ('edition', 'Edition'), ('author', 'Author')],
+                    help_text='What the books are counted by', max_length=7)),
+                ('value', models.IntegerField(help_text='Publication year, edition or author id')),
+                ('books', models.IntegerField(default=0, help_text='Number of books')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='bookstat',
+            index=models.Index(fields=['dimension', '-books', 'value'], name='books_bookstat_ranking_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookstat',
+            constraint=models.UniqueConstraint(
+                fields=('dimension', 'value'), name='books_bookstat_dimension_value_uniq'),
+        ),
+        migrations.RunPython(create_stats_triggers, drop_stats_triggers),
+    ]
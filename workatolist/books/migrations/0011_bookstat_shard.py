@@ -0,0 +1,96 @@
+from django.db import migrations, models
+
+# Year and edition counters are hot rows: every new book updates the one of its year and edition, and keeps it locked
+# until its transaction commits. They are split into SHARDS rows, each connection adding to the one of its backend
+# pid, so concurrent writers only wait for each other when their pids share a shard. Author counters are spread over
+# the authors already, and stay in shard 0 so the ranking reads them straight from its index
+SHARDS = 16
+UPSERT = (
+    'INSERT INTO books_bookstat (dimension, value, shard, books) '
+    'SELECT dimension, value, {shard}, SUM(delta) FROM ({changes}) changes '
+    'GROUP BY dimension, value HAVING SUM(delta) <> 0 ORDER BY dimension, value '
+    'ON CONFLICT (dimension, value, shard) DO UPDATE SET books = books_bookstat.books + EXCLUDED.books'
+)
+# The 0010 upsert, for the reverse migration
+UNSHARDED_UPSERT = (
+    'INSERT INTO books_bookstat (dimension, value, books) '
+    'SELECT dimension, value, SUM(delta) FROM ({changes}) changes '
+    'GROUP BY dimension, value HAVING SUM(delta) <> 0 ORDER BY dimension, value '
+    'ON CONFLICT (dimension, value) DO UPDATE SET books = books_bookstat.books + EXCLUDED.books'
+)
+BOOK_ROWS = (
+    "SELECT 'year' AS dimension, publication_year AS value, {delta} AS delta FROM {rows} "
+    "UNION ALL SELECT 'edition', edition, {delta} FROM {rows}"
+)
+AUTHOR_ROWS = "SELECT 'author' AS dimension, author_id AS value, {delta} AS delta FROM {rows}"
+FUNCTIONS = [
+    ('books_bookstat_count_books', BOOK_ROWS, 'mod(pg_backend_pid(), {})'.format(SHARDS)),
+    ('books_bookstat_count_authors', AUTHOR_ROWS, '0'),
+]
+# Adds the counters of the other shards to shard 0, before the unique constraint goes back to (dimension, value)
+MERGE_SHARDS = (
+    'WITH moved AS (DELETE FROM books_bookstat WHERE shard <> 0 RETURNING dimension, value, books) '
+    'INSERT INTO books_bookstat (dimension, value, shard, books) '
+    'SELECT dimension, value, 0, SUM(books) FROM moved GROUP BY dimension, value '
+    'ON CONFLICT (dimension, value, shard) DO UPDATE SET books = books_bookstat.books + EXCLUDED.books'
+)
+
+
+def trigger_function(name, rows, upsert):
+    inserted = rows.format(delta=1, rows='new_rows')
+    deleted = rows.format(delta=-1, rows='old_rows')
+    return (
+        'CREATE OR REPLACE FUNCTION {name}() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN '
+        "IF TG_OP = 'INSERT' THEN {insert}; "
+        "ELSIF TG_OP = 'DELETE' THEN {delete}; "
+        "ELSE {update}; END IF; "
+        'RETURN NULL; END $$'
+    ).format(
+        name=name,
+        insert=upsert(inserted),
+        delete=upsert(deleted),
+        update=upsert('{} UNION ALL {}'.format(inserted, deleted)),
+    )
+
+
+def shard_stats_triggers(apps, schema_editor):
+    """Replaces the functions run by the 0010 triggers, the triggers themselves stay"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for function, rows, shard in FUNCTIONS:
+        schema_editor.execute(trigger_function(
+            function, rows, lambda changes: UPSERT.format(shard=shard, changes=changes)))
+
+
+def unshard_stats_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for function, rows, _ in FUNCTIONS:
+        schema_editor.execute(trigger_function(
+            function, rows, lambda changes: UNSHARDED_UPSERT.format(changes=changes)))
+    schema_editor.execute(MERGE_SHARDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_bookstat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookstat',
+            name='shard',
+            field=models.SmallIntegerField(default=0, help_text='Part of the counter, the books of all of them add up'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='bookstat',
+            name='books_bookstat_dimension_value_uniq',
+        ),
+        migrations.AddConstraint(
+            model_name='bookstat',
+            constraint=models.UniqueConstraint(
+                fields=('dimension', 'value', 'shard'), name='books_bookstat_dimension_value_shard_uniq'),
+        ),
+        migrations.RunPython(shard_stats_triggers, unshard_stats_triggers),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+# The autocomplete orders the authors matching a prefix by UPPER(name). A text_pattern_ops index serves the prefix but
+# not that order, so PostgreSQL sorted every match before keeping the first ones. A plain index with the C collation
+# serves both, the order being byte order
+CREATE_INDEXES = [
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS books_author_name_upper_c '
+    'ON books_author ((UPPER(name::text) COLLATE "C"))',
+    'DROP INDEX CONCURRENTLY IF EXISTS books_author_name_upper_like',
+]
+
+DROP_INDEXES = [
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS books_author_name_upper_like '
+    'ON books_author (UPPER(name::text) text_pattern_ops)',
+    'DROP INDEX CONCURRENTLY IF EXISTS books_author_name_upper_c',
+]
+
+
+def run_on_postgresql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('books', '0011_bookstat_shard'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_postgresql(CREATE_INDEXES), run_on_postgresql(DROP_INDEXES)),
+    ]
@@ -0,0 +1,67 @@
+from django.db import migrations, models
+
+BACKFILL_BATCH_SIZE = 10000
+INDEX = models.Index(fields=['txid', 'id'], name='books_bookchange_txid_id_idx')
+
+# Assigns the transaction its id if it didn't write anything before, so it is set on every entry
+CREATE_TRIGGER = [
+    'CREATE OR REPLACE FUNCTION books_bookchange_set_txid() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN '
+    'NEW.txid := txid_current(); RETURN NEW; END $$',
+    'CREATE TRIGGER books_bookchange_txid BEFORE INSERT ON books_bookchange '
+    'FOR EACH ROW EXECUTE PROCEDURE books_bookchange_set_txid()',
+]
+# Entries recorded before the trigger were committed long ago, they come first in the feed, by sequence
+BACKFILL = 'UPDATE books_bookchange SET txid = 0 WHERE txid IS NULL AND id >= %s AND id < %s'
+DROP_TRIGGER = [
+    'DROP TRIGGER IF EXISTS books_bookchange_txid ON books_bookchange',
+    'DROP FUNCTION IF EXISTS books_bookchange_set_txid()',
+]
+
+
+def create_txid_trigger(apps, schema_editor):
+    """Creates the trigger first, so entries recorded during the backfill get their transaction too. The backfill goes
+    by batches of ids, and the index is built without locking writes to the feed"""
+    model = apps.get_model('books', 'BookChange')
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.add_index(model, INDEX)
+        return
+    for statement in CREATE_TRIGGER:
+        schema_editor.execute(statement)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT MIN(id), MAX(id) FROM books_bookchange')
+        first, last = cursor.fetchone()
+        for start in range(first or 0, (last or 0) + 1, BACKFILL_BATCH_SIZE):
+            cursor.execute(BACKFILL, [start, start + BACKFILL_BATCH_SIZE])
+    schema_editor.add_index(model, INDEX, concurrently=True)
+
+
+def drop_txid_trigger(apps, schema_editor):
+    model = apps.get_model('books', 'BookChange')
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.remove_index(model, INDEX)
+        return
+    schema_editor.remove_index(model, INDEX, concurrently=True)
+    for statement in DROP_TRIGGER:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('books', '0012_author_name_upper_c_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookchange',
+            name='txid',
+            field=models.BigIntegerField(
+                editable=False, help_text='Transaction that recorded the change, set by a trigger on PostgreSQL',
+                null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(create_txid_trigger, drop_txid_trigger)],
+            state_operations=[migrations.AddIndex(model_name='bookchange', index=INDEX)],
+        ),
+    ]
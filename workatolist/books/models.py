@@ -1,9 +1,97 @@
-from django.db import models
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from django.core.exceptions import ValidationError
+from django.db import connections, models
+from django.db.models import F, Func
+
+# Text search configuration of Book.search_vector, the trigger maintaining it is created by migration 0008
+SEARCH_CONFIG = 'english'
+
+
+class CollateC(Func):
+    """Compares the expression byte by byte on PostgreSQL, like the C collation indexes serving both its order and
+    LIKE prefix lookups. Other DBs keep their own collation"""
+    template = '%(expressions)s'
+
+    def as_postgresql(self, compiler, connection):
+        return self.as_sql(compiler, connection, template='%(expressions)s COLLATE "C"')
 
 
 class Author(models.Model):
     """Model representing book authors"""
-    name = models.CharField(max_length=200, help_text="Author name", db_index=True)
+    name = models.CharField(max_length=200, help_text="Author name", unique=True)
+
+
+def parse_integers(params, field):
+    """Parses the comma separated integers of a filter param"""
+    try:
+        return [int(value) for value in str(params.get(field)).split(',')]
+    except ValueError:
+        raise ValidationError({field: 'Enter whole numbers separated by commas.'})
+
+
+class BookQuerySet(models.QuerySet):
+    filter_fields = (
+        'authors', 'authors__in', 'edition', 'edition__in', 'name', 'name__istartswith',
+        'publication_year', 'publication_year__gte', 'publication_year__lte', 'search',
+    )
+    ordering_param = 'ordering'
+    ordering_fields = ('id', 'name', 'edition', 'publication_year')
+
+    def filter_by_params(self, params):
+        """Filters books by the filter_fields present in params, ignoring unknown and empty ones. `__in` filters take
+        comma separated values. Authors are matched through a subquery on the books/authors table, so books with
+        several matching authors are never repeated. Raises ValidationError for invalid numbers"""
+        queryset = self
+        for field in self.filter_fields:
+            if not params.get(field):
+                continue
+            if field == 'search':
+                queryset = queryset.search(params.get(field))
+            elif field.startswith('authors'):
+                book_ids = Book.authors.through.objects.filter(author_id__in=parse_integers(params, field))
+                queryset = queryset.filter(id__in=book_ids.values('book_id'))
+            elif field.startswith('name'):
+                queryset = queryset.filter(**{field: params.get(field)})
+            elif field.endswith('__in'):
+                queryset = queryset.filter(**{field: parse_integers(params, field)})
+            else:
+                values = parse_integers(params, field)
+                if len(values) != 1:
+                    raise ValidationError({field: 'Enter a whole number.'})
+                queryset = queryset.filter(**{field: values[0]})
+        return queryset
+
+    def sort_by_params(self, params):
+        """Orders books by the comma separated fields of the `ordering` param, descending when prefixed by `-`, then
+        by id so pages are stable. Books are ordered by id by default, and full-text search results by relevance"""
+        ordering = [field.strip() for field in (params.get(self.ordering_param) or '').split(',') if field.strip()]
+        unknown = [field for field in ordering if field.lstrip('-') not in self.ordering_fields]
+        if unknown:
+            raise ValidationError({self.ordering_param: 'Unknown fields: {}. Choose among: {}.'.format(
+                ', '.join(unknown), ', '.join(self.ordering_fields))})
+        if not ordering and params.get('search') and self.full_text_search:
+            return self.order_by(SearchRank(F('search_vector'), self._search_query(params.get('search'))).desc(), 'id')
+        if not any(field.lstrip('-') == 'id' for field in ordering):
+            ordering.append('id')
+        return self.order_by(*ordering)
+
+    @property
+    def full_text_search(self):
+        return connections[self.db].vendor == 'postgresql'
+
+    @staticmethod
+    def _search_query(text):
+        return SearchQuery(str(text), config=SEARCH_CONFIG)
+
+    def search(self, text):
+        """Books whose name has every word of text. On PostgreSQL it's a full-text search, matching the words stems
+        through the GIN index on search_vector, elsewhere every word must be in the name, ignoring case"""
+        if self.full_text_search:
+            return self.filter(search_vector=self._search_query(text))
+        queryset = self
+        for word in str(text).split():
+            queryset = queryset.filter(name__icontains=word)
+        return queryset
 
 
 class Book(models.Model):
@@ -12,3 +100,65 @@ class Book(models.Model):
     edition = models.PositiveSmallIntegerField(help_text="Book edition")
     publication_year = models.PositiveSmallIntegerField(help_text="Year the book was published")
     authors = models.ManyToManyField(Author, help_text="Authors of the book")
+    updated_at = models.DateTimeField(auto_now=True, help_text="Last time the book, or its authors list, changed")
+    search_vector = SearchVectorField(null=True, editable=False,
+                                      help_text="Words of the name, maintained by a trigger on PostgreSQL")
+
+    objects = BookQuerySet.as_manager()
+
+    class Meta:
+        # Back the common filters, with the default ordering on id. The case insensitive name prefix index is an
+        # expression, and the books/authors table can't declare indexes, both are created by a migration on PostgreSQL
+        indexes = [
+            models.Index(fields=['publication_year', 'id'], name='books_book_year_id_idx'),
+            models.Index(fields=['edition', 'publication_year'], name='books_book_edition_year_idx'),
+            models.Index(fields=['name', 'id'], name='books_book_name_id_idx'),
+        ]
+
+
+class BookChange(models.Model):
+    """Entry of the books change feed, see books.changes. The id is the sequence clients sync from, and book_id isn't a
+    foreign key, so the tombstones of deleted books stay"""
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    OPERATIONS = [(CREATED, 'Created'), (UPDATED, 'Updated'), (DELETED, 'Deleted')]
+
+    id = models.BigAutoField(primary_key=True)
+    book_id = models.IntegerField(help_text="Id of the book changed")
+    operation = models.CharField(max_length=7, choices=OPERATIONS, help_text="What happened to the book")
+    changed_at = models.DateTimeField(auto_now_add=True, help_text="Time the change was recorded")
+    txid = models.BigIntegerField(null=True, editable=False,
+                                  help_text="Transaction that recorded the change, set by a trigger on PostgreSQL")
+
+    class Meta:
+        # The feed order on PostgreSQL, see books.changes.feed_order
+        indexes = [models.Index(fields=['txid', 'id'], name='books_bookchange_txid_id_idx')]
+
+
+class BookStat(models.Model):
+    """Number of books per publication year, edition or author id. Triggers created by migration 0010 keep it up to
+    date on PostgreSQL, with one statement per write statement, see books.stats.
+
+    A write locks the counters it updates until its transaction commits, and every book updates the counter of its
+    year and edition, so concurrent writers would queue on them. Those counters are split in SHARDS rows, each DB
+    connection writing to one of them (migration 0011), and are read by adding up their shards. Writers still wait
+    for each other when their connections share a shard, or when they update the counter of the same author"""
+    SHARDS = 16
+    YEAR = 'year'
+    EDITION = 'edition'
+    AUTHOR = 'author'
+    DIMENSIONS = [(YEAR, 'Publication year'), (EDITION, 'Edition'), (AUTHOR, 'Author')]
+
+    dimension = models.CharField(max_length=7, choices=DIMENSIONS, help_text="What the books are counted by")
+    value = models.IntegerField(help_text="Publication year, edition or author id")
+    books = models.IntegerField(default=0, help_text="Number of books")
+    shard = models.SmallIntegerField(default=0, help_text="Part of the counter, the books of all of them add up")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'value', 'shard'],
+                                    name='books_bookstat_dimension_value_shard_uniq'),
+        ]
+        # Authors with the most books first
+        indexes = [models.Index(fields=['dimension', '-books', 'value'], name='books_bookstat_ranking_idx')]
@@ -0,0 +1,190 @@
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.compat import coreapi, coreschema
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
+
+# Seconds the planner estimate of a table is reused for, it only changes when the table is vacuumed or analyzed anyway
+ESTIMATE_MAX_AGE = 60
+
+COUNT_DESCRIPTION = 'Use `exact` to count every row of large unfiltered lists, instead of estimating their size.'
+
+_estimates = {}
+
+
+def estimated_row_count(model, using):
+    """Returns the number of rows of the model table according to the PostgreSQL planner statistics, scaled to the
+    current size of the table like the planner itself does. None on other DBs and for tables never analyzed"""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    key = (using, model._meta.db_table)
+    cached = _estimates.get(key)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples, relpages, pg_relation_size(oid) / current_setting('block_size')::int "
+            "FROM pg_class WHERE oid = %s::regclass", [connection.ops.quote_name(model._meta.db_table)])
+        row = cursor.fetchone()
+    reltuples, relpages, pages = row
+    estimate = int(reltuples / relpages * pages) if relpages > 0 and reltuples >= 0 else None
+    _estimates[key] = (estimate, time.monotonic() + ESTIMATE_MAX_AGE)
+    return estimate
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor pagination keyed on the primary key. Pages are fetched with `WHERE id > <last id>`, so deep pages cost the
+    same as the first one, and no count query is issued"""
+    ordering = 'id'
+    page_size_query_param = 'limit'
+
+
+class LimitOffsetOrCursorPagination(LimitOffsetPagination):
+    """Keeps limit/offset pagination for existing consumers, while clients that send `pagination=cursor`, or follow a
+    `cursor` link, get keyset pagination with opaque next/previous cursors.
+
+    Unfiltered lists of tables bigger than the ESTIMATED_COUNT_THRESHOLD setting report the planner estimate of their
+    size instead of counting every row, flagged by `count_estimated`. Filtered lists, and requests sending
+    `count=exact`, are counted"""
+    mode_query_param = 'pagination'
+    cursor_mode = 'cursor'
+    cursor_pagination_class = KeysetPagination
+    count_query_param = 'count'
+    exact_count = 'exact'
+
+    def __init__(self):
+        self.cursor_paginator = None
+        self.view = None
+        self.count_estimated = False
+
+    @property
+    def query_params(self):
+        """Every query param that changes the page returned"""
+        return (self.limit_query_param, self.offset_query_param, self.mode_query_param,
+                self.cursor_pagination_class.cursor_query_param, self.count_query_param)
+
+    def use_cursor(self, request):
+        return (request.query_params.get(self.mode_query_param) == self.cursor_mode
+                or self.cursor_pagination_class.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        self.view = view
+        estimate = self.get_estimated_count(queryset, request)
+        if estimate is None:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        self.request = request
+        # One row past the page tells whether there is a next one, the estimate may fall short of the offset
+        page = list(queryset[self.offset:self.offset + self.limit + 1])
+        if len(page) > self.limit:
+            self.count, self.count_estimated = max(estimate, self.offset + len(page)), True
+        elif page or not self.offset:
+            self.count = self.offset + len(page)
+        else:
+            self.count, self.count_estimated = estimate, True
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+        return page[:self.limit]
+
+    def get_estimated_count(self, queryset, request):
+        """Returns the estimated size of unfiltered querysets of large tables, None when they must be counted"""
+        threshold = getattr(settings, 'ESTIMATED_COUNT_THRESHOLD', 0)
+        if not threshold or queryset.query.where or self.use_cursor(request):
+            return None
+        if request.query_params.get(self.count_query_param) == self.exact_count:
+            return None
+        estimate = estimated_row_count(queryset.model, queryset.db)
+        return estimate if estimate is not None and estimate > threshold else None
+
+    def get_count(self, queryset):
+        """Reuses the count the view may already have computed for the same queryset"""
+        known_count = getattr(self.view, 'known_count', None)
+        if known_count is not None:
+            return known_count
+        return super().get_count(queryset)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('count_estimated', self.count_estimated),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        paginated_schema = super().get_paginated_response_schema(schema)
+        paginated_schema['properties']['count_estimated'] = {'type': 'boolean'}
+        return paginated_schema
+
+    def get_schema_fields(self, view):
+        return super().get_schema_fields(view) + [
+            coreapi.Field(
+                name=self.mode_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.Enum(
+                    [self.cursor_mode],
+                    title='Pagination mode',
+                    description='Use `cursor` to get keyset pagination, without a total count.'
+                )
+            ),
+            coreapi.Field(
+                name=self.cursor_pagination_class.cursor_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.String(
+                    title='Cursor',
+                    description=self.cursor_pagination_class.cursor_query_description
+                )
+            ),
+            coreapi.Field(
+                name=self.count_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.Enum(
+                    [self.exact_count],
+                    title='Count',
+                    description=COUNT_DESCRIPTION
+                )
+            ),
+        ]
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                'name': self.mode_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Use `cursor` to get keyset pagination, without a total count.',
+                'schema': {'type': 'string', 'enum': [self.cursor_mode]},
+            },
+            {
+                'name': self.cursor_pagination_class.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': self.cursor_pagination_class.cursor_query_description,
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.count_query_param,
+                'required': False,
+                'in': 'query',
+                'description': COUNT_DESCRIPTION,
+                'schema': {'type': 'string', 'enum': [self.exact_count]},
+            },
+        ]
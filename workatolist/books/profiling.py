@@ -0,0 +1,108 @@
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+
+TOKEN_SALT = 'books.profiling'
+TOKEN_VALUE = 'profile'
+
+CPROFILE = 'cprofile'
+SAMPLING = 'sampling'
+EXTENSIONS = {CPROFILE: '.pstats', SAMPLING: '.collapsed'}
+
+
+def get_config():
+    return dict({
+        'ENABLED': False,
+        'SAMPLE_RATE': 0,
+        'MODE': CPROFILE,
+        'DIRECTORY': os.path.join(settings.BASE_DIR, 'profiles'),
+        'SAMPLING_INTERVAL': 0.005,
+        'TOKEN_MAX_AGE': 3600,
+    }, **getattr(settings, 'REQUEST_PROFILING', {}))
+
+
+def make_token():
+    """Returns a token for the X-Profile-Token header, valid for TOKEN_MAX_AGE seconds"""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(TOKEN_VALUE)
+
+
+def check_token(token, max_age):
+    try:
+        return signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=max_age) == TOKEN_VALUE
+    except signing.BadSignature:
+        return False
+
+
+def frame_name(code):
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class CProfileProfiler:
+    """Deterministic profile of every function call, written as a pstats file"""
+
+    def __init__(self, interval=None):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def save(self, file_path):
+        self.profile.dump_stats(file_path)
+
+
+class StackSampler:
+    """Samples the stack of the thread that started it from a background thread every interval seconds. Much cheaper
+    than cProfile on call heavy code, and the stacks are written collapsed, one `root;...;leaf count` line per stack,
+    ready for flamegraph.pl or speedscope. The sampler needs the GIL, so intervals below sys.getswitchinterval(), 5ms
+    by default, don't make it any more precise"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._target = None
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def save(self, file_path):
+        with open(file_path, 'w') as file:
+            file.writelines('{} {}\n'.format(stack, count) for stack, count in self.stacks.items())
+
+
+PROFILERS = {CPROFILE: CProfileProfiler, SAMPLING: StackSampler}
+
+
+def profile_path(directory, route, mode):
+    """Returns a new file path for a profile of the route, under a directory named after it"""
+    route_directory = os.path.join(directory, re.sub(r'[^\w.-]', '_', route))
+    os.makedirs(route_directory, exist_ok=True)
+    file_name = '{}-{}-{}{}'.format(time.time_ns(), os.getpid(), threading.get_ident(), EXTENSIONS[mode])
+    return os.path.join(route_directory, file_name)
@@ -0,0 +1,20 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+
+
+class FastJSONRenderer(JSONRenderer):
+    """Renders the same bytes as JSONRenderer with orjson, several times faster on large pages. Indented or ASCII only
+    output, and data orjson would encode differently (datetimes, lazy strings, huge ints...), go through JSONRenderer.
+    Floats are encoded by orjson as well, the API doesn't have any"""
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or self.ensure_ascii or not self.compact or self.get_indent(
+                accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, option=self.options)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same escaping as JSONRenderer, those are valid JSON but not valid javascript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
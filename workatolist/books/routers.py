@@ -0,0 +1,132 @@
+import contextvars
+import itertools
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+ROUND_ROBIN = 'round_robin'
+LEAST_LAG = 'least_lag'
+# App label of the model Django's database cache uses for its table
+CACHE_APP_LABEL = 'django_cache'
+
+current_routing = contextvars.ContextVar('current_routing', default=None)
+
+
+def get_config():
+    return dict({
+        'ENABLED': False,
+        'ALIASES': [],
+        'SELECTION': ROUND_ROBIN,
+        'HEALTH_CHECK_INTERVAL': 5,
+        'MAX_LAG': 30,
+        'PIN_SECONDS': 10,
+    }, **getattr(settings, 'DATABASE_REPLICAS', {}))
+
+
+def replication_lag(alias):
+    """Returns how many seconds the DB is behind its primary, 0 when it replayed everything it received or isn't a
+    replica at all"""
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+                'THEN 0 ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END')
+        else:
+            cursor.execute('SELECT 0')
+        return float(cursor.fetchone()[0])
+
+
+class Routing:
+    """Where the reads of the current request go. alias is None for requests that must read from the primary"""
+
+    def __init__(self, alias=None):
+        self.alias = alias
+        self.wrote = False
+
+
+def reads_from_primary():
+    """Whether the reads of the current request go to the primary, always the case without ReplicaRoutingMiddleware"""
+    routing = current_routing.get()
+    return routing is None or routing.alias is None or routing.wrote
+
+
+class ReplicaPool:
+    """Picks the replica a request reads from, among the ones that are up and lag at most max_lag seconds. Each replica
+    is checked at most once per interval seconds, by the request needing it, and left out until its next check when it
+    fails"""
+
+    def __init__(self, aliases, selection=ROUND_ROBIN, interval=5, max_lag=30):
+        if selection not in (ROUND_ROBIN, LEAST_LAG):
+            raise ImproperlyConfigured(
+                'DATABASE_REPLICAS SELECTION must be one of: {}, {}'.format(ROUND_ROBIN, LEAST_LAG))
+        self.aliases = list(aliases)
+        self.selection = selection
+        self.interval = interval
+        self.max_lag = max_lag
+        self.lags = {}
+        self._checked_at = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def lag(self, alias):
+        """Returns the lag of the replica as of its last check, None when it is down or wasn't checked yet"""
+        now = time.monotonic()
+        with self._lock:
+            checked_at = self._checked_at.get(alias)
+            due = checked_at is None or checked_at + self.interval <= now
+            if due:
+                self._checked_at[alias] = now
+        if due:
+            try:
+                self.lags[alias] = replication_lag(alias)
+            except DatabaseError:
+                self.lags[alias] = None
+        return self.lags.get(alias)
+
+    def mark_down(self, alias):
+        with self._lock:
+            self._checked_at[alias] = time.monotonic()
+            self.lags[alias] = None
+
+    def choose(self):
+        """Returns the alias of a healthy replica, or None to fall back to the primary"""
+        healthy = []
+        for alias in self.aliases:
+            lag = self.lag(alias)
+            if lag is not None and lag <= self.max_lag:
+                healthy.append((lag, alias))
+        if not healthy:
+            return None
+        if self.selection == LEAST_LAG:
+            return min(healthy)[1]
+        return healthy[next(self._counter) % len(healthy)][1]
+
+
+class ReplicaRouter:
+    """Sends the reads of the requests ReplicaRoutingMiddleware picked a replica for to it, and every write to the
+    primary. Once a request writes, its following reads go to the primary too. The database cache only lives on the
+    primary, as the replicas would miss its latest invalidations, and writing to it isn't a write of the request"""
+
+    def db_for_read(self, model, **hints):
+        routing = current_routing.get()
+        if routing is None:
+            return None
+        if routing.alias is None or routing.wrote or model._meta.app_label == CACHE_APP_LABEL:
+            return DEFAULT_DB_ALIAS
+        return routing.alias
+
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None and model._meta.app_label != CACHE_APP_LABEL:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_config()['ALIASES']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
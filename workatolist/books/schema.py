@@ -0,0 +1,130 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import django
+import drf_yasg
+import rest_framework
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson, yaml_sane_dump
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.views import SPEC_RENDERERS, get_schema_view
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+API_INFO = openapi.Info(
+    title="Work At Olist API",
+    default_version='v1',
+)
+# The code the schema is introspected from, relative to BASE_DIR
+SOURCE_FILES = ('books/*.py', 'workatolist/*urls.py')
+
+
+def get_config():
+    return dict({'FILE': None, 'VERSION': ''}, **getattr(settings, 'OPENAPI_SCHEMA', {}))
+
+
+def source_fingerprint():
+    """Hashes the code the schema is introspected from, along with the versions of the libraries introspecting it"""
+    digest = hashlib.sha1(repr((django.__version__, rest_framework.VERSION, drf_yasg.__version__)).encode())
+    paths = [path for pattern in SOURCE_FILES for path in glob.glob(os.path.join(settings.BASE_DIR, pattern))]
+    for path in sorted(paths):
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return 'source-{}'.format(digest.hexdigest())
+
+
+def schema_version():
+    """Returns the VERSION the schema file is built for, or when it isn't set the fingerprint of the source, so a file
+    built from other code is never served"""
+    return get_config()['VERSION'] or source_fingerprint()
+
+
+def build_schema():
+    """Introspects every viewset and serializer into the OpenAPI schema, as a dict. Views are introspected with a mock
+    request, like the drf_yasg generate_swagger command does, and the host of that request is left out: Swagger UI
+    then calls the host serving the schema"""
+    request = APIView().initialize_request(APIRequestFactory().get('/docs/?format=openapi'))
+    swagger = OpenAPISchemaGenerator(API_INFO).get_schema(request=request, public=True)
+    schema = json.loads(OpenAPICodecJson(validators=[]).encode(swagger).decode(), object_pairs_hook=OrderedDict)
+    schema.pop('host', None)
+    schema.pop('schemes', None)
+    return schema
+
+
+def write_schema(file_path, version):
+    with open(file_path, 'w') as file:
+        json.dump({'version': version, 'schema': build_schema()}, file)
+
+
+def read_schema(file_path, version):
+    """Returns the schema stored in the file, or None when there is no file or it was built for another version"""
+    try:
+        with open(file_path) as file:
+            stored = json.load(file, object_pairs_hook=OrderedDict)
+    except FileNotFoundError:
+        return None
+    return stored['schema'] if stored.get('version') == version else None
+
+
+class SchemaStore:
+    """The schema encoded in JSON or YAML, with their ETags. It is read from the file written by the buildschema
+    command, or else built on first use, once per process"""
+    encoders = {
+        'json': lambda schema: json.dumps(schema).encode(),
+        'yaml': lambda schema: yaml_sane_dump(schema, binary=True),
+    }
+
+    def __init__(self):
+        self._schema = None
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def get(self, format):
+        """Returns the (content, ETag) pair of the schema encoded in `json` or `yaml`"""
+        encoded = self._encoded.get(format)
+        if encoded is None:
+            with self._lock:
+                if format not in self._encoded:
+                    content = self.encoders[format](self._load())
+                    self._encoded[format] = content, '"{}"'.format(hashlib.sha1(content).hexdigest())
+                encoded = self._encoded[format]
+        return encoded
+
+    def invalidate(self):
+        with self._lock:
+            self._encoded = {}
+            self._schema = None
+
+    def _load(self):
+        if self._schema is None:
+            config = get_config()
+            schema = read_schema(config['FILE'], schema_version()) if config['FILE'] else None
+            self._schema = build_schema() if schema is None else schema
+        return self._schema
+
+
+schema_store = SchemaStore()
+
+
+class SchemaView(get_schema_view(API_INFO, public=True)):
+    """Serves the schema from schema_store, with an ETag, instead of introspecting the API on each request. The UI
+    pages don't need the schema, they download it from this same view"""
+
+    def get(self, request, version='', format=None):
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, SPEC_RENDERERS):
+            return super().get(request, version, format)
+
+        content, etag = schema_store.get('yaml' if renderer.format == 'yaml' else 'json')
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(content, content_type=renderer.media_type)
+        response['ETag'] = etag
+        return response
@@ -2,34 +2,71 @@ from django.db import transaction
 
 from rest_framework import serializers
 
-from books.models import Author, Book
+from books.bulk import replace_book_authors
+from books.cache import invalidate_book
+from books.changes import record_changes
+from books.metrics import measure
+from books.models import Author, Book, BookChange
 
 
-class AuthorSerializer(serializers.ModelSerializer):
+class MeasuredListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with measure('serialize'):
+            return super().data
+
+
+class MeasuredSerializerMixin:
+    """Reports the time spent building the response data to the instrumentation middleware"""
+
+    @property
+    def data(self):
+        with measure('serialize'):
+            return super().data
+
+
+class AuthorSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
     id = serializers.IntegerField(required=True)
     name = serializers.CharField(read_only=True)
 
     class Meta:
         model = Author
         fields = ('id', 'name')
+        list_serializer_class = MeasuredListSerializer
 
 
-class BookSerializer(serializers.ModelSerializer):
+class BookSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
+    """Books with their authors nested. Readers may restrict the representation to the `fields` given in the context,
+    and get author ids instead of nested authors with `expand_authors` set to False"""
     authors = AuthorSerializer(many=True)
 
     class Meta:
         model = Book
-        fields = '__all__'
+        exclude = ('updated_at', 'search_vector')
+        list_serializer_class = MeasuredListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+        if not self.context.get('expand_authors', True) and 'authors' in self.fields:
+            self.fields['authors'] = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
 
     def validate_authors(self, value):
         if not value:
             raise serializers.ValidationError({'detail': 'At least one author is required'})
 
-        for author in value:
-            try:
-                Author.objects.get(id=author['id'])
-            except Author.DoesNotExist:
-                raise serializers.ValidationError({'detail': 'Author does not exists'})
+        author_ids = {author['id'] for author in value}
+        # Callers validating many books at once may provide the ids of the existing authors, loaded upfront
+        known_author_ids = self.context.get('known_author_ids')
+        if known_author_ids is not None:
+            exists = author_ids <= known_author_ids
+        else:
+            exists = Author.objects.filter(id__in=author_ids).count() == len(author_ids)
+        if not exists:
+            raise serializers.ValidationError({'detail': 'Author does not exists'})
         return value
 
     @transaction.atomic
@@ -37,6 +74,8 @@ class BookSerializer(serializers.ModelSerializer):
         authors = validate_data.pop('authors')
         instance = Book.objects.create(**validate_data)
         instance = self._append_author_objects(authors, instance)
+        record_changes([instance.id], BookChange.CREATED)
+        invalidate_book(instance.id)
         return instance
 
     @transaction.atomic
@@ -47,16 +86,17 @@ class BookSerializer(serializers.ModelSerializer):
 
         authors = validated_data.get('authors', [])
         if authors:
-            instance.authors.clear()
-            instance = self._append_author_objects(authors, instance)
+            replace_book_authors([(instance.id, [author['id'] for author in authors])])
 
         instance.save()
+        record_changes([instance.id], BookChange.UPDATED)
+        invalidate_book(instance.id)
         return instance
 
     @staticmethod
     def _append_author_objects(authors, instance):
-        """Iterates over the authors list, find the Author object from that id and append to the Book obj"""
-        for author in authors:
-            author_object = Author.objects.get(id=author['id'])
-            instance.authors.add(author_object)
+        """Links the already validated authors ids to the Book obj, inserting all the relation rows at once"""
+        author_ids = dict.fromkeys(author['id'] for author in authors)
+        BookAuthors = Book.authors.through
+        BookAuthors.objects.bulk_create([BookAuthors(book=instance, author_id=author_id) for author_id in author_ids])
         return instance
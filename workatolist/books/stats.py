@@ -0,0 +1,32 @@
+from django.db import connections
+from django.db.models import Count, Sum
+
+from books.models import Author, Book, BookStat
+
+BOOK_DIMENSIONS = {BookStat.YEAR: 'publication_year', BookStat.EDITION: 'edition'}
+
+
+def uses_summary_table():
+    """BookStat is kept up to date by triggers on PostgreSQL only, other DBs count the books on every request"""
+    return connections[BookStat.objects.all().db].vendor == 'postgresql'
+
+
+def books_by(dimension):
+    """Returns (value, number of books) pairs for every publication year or edition, in ascending order"""
+    if uses_summary_table():
+        stats = BookStat.objects.filter(dimension=dimension).order_by('value').values_list('value')
+        return list(stats.annotate(total=Sum('books')).filter(total__gt=0))
+    field = BOOK_DIMENSIONS[dimension]
+    return list(Book.objects.order_by(field).values_list(field).annotate(books=Count('id')))
+
+
+def books_by_author(offset, limit):
+    """Returns (author id, author name, number of books) for the authors with the most books, ties by id"""
+    if not uses_summary_table():
+        authors = Author.objects.annotate(books=Count('book')).filter(books__gt=0).order_by('-books', 'id')
+        return list(authors.values_list('id', 'name', 'books')[offset:offset + limit])
+
+    stats = list(BookStat.objects.filter(dimension=BookStat.AUTHOR, books__gt=0).order_by('-books', 'value')
+                 .values_list('value', 'books')[offset:offset + limit])
+    names = dict(Author.objects.filter(id__in=[author_id for author_id, _ in stats]).values_list('id', 'name'))
+    return [(author_id, names[author_id], books) for author_id, books in stats if author_id in names]
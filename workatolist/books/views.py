@@ -1,31 +1,400 @@
-from rest_framework import viewsets
+import hashlib
 
-from books.models import Author, Book
+from django.core.exceptions import PermissionDenied, ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import Count, Max, Prefetch
+from django.db.models.functions import Upper
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from books.batch import ATOMIC, BatchSerializer, BookBatch
+from books.cache import (
+    AUTHORS_NAMESPACE, BOOKS_NAMESPACE, book_namespace, invalidate_book, normalize_query_params, response_cache)
+from books.changes import ChangesExpired, latest_sequence, read_changes, record_changes
+from books.export import EXPORT_FORMATS, gzip_chunks, iter_books, iter_chunks
+from books.metrics import get_config as metrics_config, is_authorized, measure, metrics as request_metrics
+from books.models import Author, Book, BookChange, BookQuerySet, BookStat, CollateC
+from books.representations import AUTHOR_VALUES, BOOK_FIELDS, BOOK_VALUES, book_representations, book_values
+from books.routers import reads_from_primary
 from books.serializers import AuthorSerializer, BookSerializer
+from books.stats import books_by, books_by_author
+
+
+class CachedResponseMixin:
+    """Serves list and retrieve from the response cache. Cache keys only take into account the filter params listed
+    in valid_fields_filter_list and the pagination params, the same ones that shape the response.
+
+    Views that can tell upfront whether their data changed implement get_conditional_validators, then responses carry
+    ETag/Last-Modified headers and conditional requests are answered with 304 Not Modified before serializing anything.
+    Validators are cached along with the data, so cache hits are answered without querying the books"""
+    cache_namespace = None
+    valid_fields_filter_list = []
+    representation_query_params = []
+
+    def get_cache_namespace(self):
+        return self.cache_namespace
+
+    def get_cache_query_params(self):
+        return (list(self.valid_fields_filter_list) + list(self.representation_query_params)
+                + list(getattr(self.paginator, 'query_params', ())))
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_conditional_validators(self):
+        """Returns the (etag, last modified timestamp) pair of the response, or None when the view can't tell. The
+        timestamp is None when only the ETag tells"""
+        return None
+
+    def _cached_response(self, handler, request, *args, **kwargs):
+        key = response_cache.make_key(self.get_cache_namespace(), request, self.get_cache_query_params(),
+                                      replica=not reads_from_primary())
+        cached = response_cache.get(key)
+        if cached is not None:
+            data, validators = cached
+        else:
+            data, validators = None, self.get_conditional_validators()
+
+        response = None
+        if validators:
+            etag, last_modified = validators
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+        if response is None and data is not None:
+            response = Response(data)
+        elif response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code == 200:
+                response_cache.set(key, (response.data, validators))
 
+        response['X-Cache'] = 'MISS' if cached is None else 'HIT'
+        if validators and response.status_code in (200, 304):
+            response['ETag'] = validators[0]
+            if validators[1] is not None:
+                response['Last-Modified'] = http_date(validators[1])
+        return response
 
-class AuthorViewSet(viewsets.ReadOnlyModelViewSet):
+
+class ValuesReadMixin:
+    """Serves list and retrieve from values() rows turned straight into the serializer representation by
+    to_representations, skipping the serializer machinery that dominates the CPU time of large pages. Responses are
+    the same byte for byte, set fast_read to False to go through the serializer instead"""
+    fast_read = True
+    values_fields = ()
+
+    def get_values_fields(self):
+        return self.values_fields
+
+    def to_representations(self, rows):
+        """Turns the values() rows into the serializer representation. Rows are returned as they are by default, which
+        is right for serializers made of the values_fields only, as plain fields in the same order"""
+        return list(rows)
+
+    def get_values_queryset(self):
+        return self.filter_queryset(self.get_queryset()).prefetch_related(None).values(*self.get_values_fields())
+
+    def list(self, request, *args, **kwargs):
+        if not self.fast_read:
+            return super().list(request, *args, **kwargs)
+        queryset = self.get_values_queryset()
+        page = self.paginate_queryset(queryset)
+        with measure('serialize'):
+            data = self.to_representations(list(queryset) if page is None else page)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.fast_read:
+            return super().retrieve(request, *args, **kwargs)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(self.get_values_queryset(), **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        with measure('serialize'):
+            data = self.to_representations([row])[0]
+        return Response(data)
+
+
+class AuthorViewSet(CachedResponseMixin, ValuesReadMixin, viewsets.ReadOnlyModelViewSet):
     """Viewset to list and retrieve authors"""
 
     queryset = Author.objects.all()
     serializer_class = AuthorSerializer
     lookup_field = 'name'
     lookup_value_regex = '[^/]+'
+    cache_namespace = AUTHORS_NAMESPACE
+    values_fields = AUTHOR_VALUES
+    autocomplete_limit = 10
+    autocomplete_max_limit = 50
+    contains_min_length = 3
+
+    @action(detail=False)
+    def autocomplete(self, request):
+        """Returns up to `limit` authors matching the `q` parameter, case insensitive. Names starting with `q` come
+        first, in the order of the UPPER(name) index of migration 0012, so PostgreSQL reads just the first `limit`
+        entries of the prefix. Names containing `q` follow for terms of contains_min_length characters or more, the
+        shortest ones the trigram index can serve"""
+        term = request.query_params.get('q', '').strip()
+        if not term:
+            raise ValidationError({'q': 'This parameter is required.'})
+        limit = self._get_autocomplete_limit(request)
 
+        ordering = CollateC(Upper('name'))
+        authors = list(self.queryset.filter(name__istartswith=term).order_by(ordering)[:limit])
+        if len(authors) < limit and len(term) >= self.contains_min_length:
+            authors += self.queryset.filter(name__icontains=term).exclude(
+                name__istartswith=term).order_by(ordering)[:limit - len(authors)]
+        return Response(self.get_serializer(authors, many=True).data)
 
-class BookViewSet(viewsets.ModelViewSet):
+    def _get_autocomplete_limit(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.autocomplete_limit))
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required.'})
+        if limit < 1:
+            raise ValidationError({'limit': 'Ensure this value is greater than or equal to 1.'})
+        return min(limit, self.autocomplete_max_limit)
+
+
+class BookViewSet(CachedResponseMixin, ValuesReadMixin, viewsets.ModelViewSet):
     """Viewset to list, retrive, create, update and delete books"""
 
-    queryset = Book.objects.all()
+    queryset = Book.objects.prefetch_related(Prefetch('authors', queryset=Author.objects.order_by('id')))
     serializer_class = BookSerializer
-    valid_fields_filter_list = ['authors', 'edition', 'name', 'publication_year']
+    values_fields = BOOK_VALUES
+    valid_fields_filter_list = BookQuerySet.filter_fields + (BookQuerySet.ordering_param,)
+    representation_query_params = ['fields', 'expand']
+    cache_namespace = BOOKS_NAMESPACE
+    known_count = None
+    changes_limit = 100
+    changes_max_limit = 1000
+    stats_authors_limit = 10
+    stats_authors_max_limit = 1000
+
+    def get_cache_namespace(self):
+        lookup = self.kwargs.get(self.lookup_field, '')
+        if lookup.isdigit():
+            return book_namespace(int(lookup))
+        return super().get_cache_namespace()
+
+    def get_conditional_validators(self):
+        """Computes the validators from the number of books and their last modification, a single aggregate query
+        served by the same filters as the response itself. Cursor pages are skipped, they never count the books, and so
+        are the lists whose count is estimated, counting them is the very cost the estimate saves. Lists only get an
+        ETag: a book leaving them, deleted or no longer matching the filters, doesn't change their last modification"""
+        lookup = self.kwargs.get(self.lookup_field)
+        if lookup is not None:
+            if not lookup.isdigit():
+                return None
+            queryset = Book.objects.filter(pk=lookup)
+        elif self.paginator.use_cursor(self.request):
+            return None
+        else:
+            queryset = self.filter_queryset(self.get_queryset())
+            if self.paginator.get_estimated_count(queryset, self.request) is not None:
+                return None
+
+        stats = queryset.order_by().aggregate(count=Count('id'), last_modified=Max('updated_at'))
+        if lookup is None:
+            self.known_count = stats['count']
+            return self._make_etag(stats), None
+        if not stats['count']:
+            return None
+        return self._make_etag(stats), int(stats['last_modified'].timestamp())
+
+    def _make_etag(self, stats):
+        params = normalize_query_params(self.request, self.get_cache_query_params())
+        digest = hashlib.sha1(repr((self.request.path, params, stats)).encode()).hexdigest()
+        return 'W/"{}"'.format(digest)
+
+    @action(detail=False, methods=['post'], serializer_class=BatchSerializer)
+    def batch(self, request):
+        """Applies a list of operations, each one like `{"op": "create", "data": {<book>}}`,
+        `{"op": "update", "id": <id>, "data": {<book>}, "partial": false}` or `{"op": "delete", "id": <id>}`, returning
+        the result of each one. In `atomic` mode, the default, nothing is applied unless every operation is valid"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        batch = BookBatch(**serializer.validated_data)
+        results = batch.run()
+
+        response_status = status.HTTP_400_BAD_REQUEST if batch.mode == ATOMIC and batch.failed else status.HTTP_200_OK
+        return Response({'mode': batch.mode, 'results': results}, status=response_status)
+
+    def perform_destroy(self, instance):
+        book_id = instance.id
+        with transaction.atomic():
+            super().perform_destroy(instance)
+            record_changes([book_id], BookChange.DELETED)
+        invalidate_book(book_id)
+
+    @action(detail=False)
+    def changes(self, request):
+        """Lists what happened to books after the `since` sequence, in commit order, so mirrors sync only what changed.
+        Each book is listed once per page with its latest change, and its current data unless it was deleted. Keep the
+        `token` of the response for the next sync, and follow `next` while there are more changes. Start with
+        `since=latest` right before downloading the full list. Sequences older than the retained changes get a 410,
+        asking for a full sync again"""
+        since = request.query_params.get('since', '0')
+        if since == 'latest':
+            return Response({'token': latest_sequence(), 'has_more': False, 'next': None, 'changes': []})
+        if not since.isdigit():
+            raise ValidationError({'since': 'Enter a sequence token, or `latest`.'})
+        limit = self._get_limit(request, self.changes_limit, self.changes_max_limit)
+
+        try:
+            entries, has_more = read_changes(int(since), limit)
+        except ChangesExpired:
+            return Response({'detail': 'Changes after this token were pruned, sync the full list again.'},
+                            status=status.HTTP_410_GONE)
+
+        latest = {entry.book_id: entry for entry in entries}
+        rows = Book.objects.filter(id__in=latest).values(*BOOK_VALUES)
+        books = {book['id']: book for book in book_representations(rows)}
+        changes = []
+        for entry in entries:
+            if latest[entry.book_id] is not entry:
+                continue
+            book = books.get(entry.book_id)
+            changes.append({
+                'sequence': entry.id,
+                'id': entry.book_id,
+                'operation': entry.operation if book is not None else BookChange.DELETED,
+                'changed_at': entry.changed_at,
+                'book': book,
+            })
+
+        token = entries[-1].id if entries else int(since)
+        next_url = None
+        if has_more:
+            next_url = replace_query_param(request.build_absolute_uri(), 'since', token)
+        return Response({'token': token, 'has_more': has_more, 'next': next_url, 'changes': changes})
+
+    @action(detail=False, url_path='stats/years')
+    def stats_years(self, request):
+        """Number of books published each year. Read from a summary table updated along with the books on PostgreSQL,
+        so it costs the same whatever the size of the catalogue"""
+        return Response([{'publication_year': year, 'books': books} for year, books in books_by(BookStat.YEAR)])
+
+    @action(detail=False, url_path='stats/editions')
+    def stats_editions(self, request):
+        """Number of books of each edition, read from the same summary table as the years"""
+        return Response([{'edition': edition, 'books': books} for edition, books in books_by(BookStat.EDITION)])
+
+    @action(detail=False, url_path='stats/authors')
+    def stats_authors(self, request):
+        """Number of books of each author, the authors with the most books first, paginated with `limit` and
+        `offset`"""
+        limit = self._get_limit(request, self.stats_authors_limit, self.stats_authors_max_limit)
+        try:
+            offset = int(request.query_params.get('offset', 0))
+        except ValueError:
+            raise ValidationError({'offset': 'A valid integer is required.'})
+        if offset < 0:
+            raise ValidationError({'offset': 'Ensure this value is greater than or equal to 0.'})
+
+        # One more row tells whether there is a next page
+        authors = books_by_author(offset, limit + 1)
+        url = request.build_absolute_uri()
+        next_url = previous_url = None
+        if len(authors) > limit:
+            next_url = replace_query_param(url, 'offset', offset + limit)
+        if offset:
+            previous_url = replace_query_param(url, 'offset', max(offset - limit, 0))
+        return Response({
+            'next': next_url,
+            'previous': previous_url,
+            'results': [{'id': author_id, 'name': name, 'books': books} for author_id, name, books in authors[:limit]],
+        })
+
+    @staticmethod
+    def _get_limit(request, default, maximum):
+        try:
+            limit = int(request.query_params.get('limit', default))
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required.'})
+        if limit < 1:
+            raise ValidationError({'limit': 'Ensure this value is greater than or equal to 1.'})
+        return min(limit, maximum)
+
+    def get_representation_options(self):
+        """Parses the `fields` param, a comma separated list of the book fields to return, and the `expand` one,
+        `authors` (the default) to nest the authors or `none` to only return their ids. Only list and retrieve
+        take them into account"""
+        if self.action not in ('list', 'retrieve'):
+            return BOOK_FIELDS, True
+        requested = self.request.query_params.get('fields', '').split(',')
+        requested = {field.strip() for field in requested if field.strip()}
+        unknown = requested - set(BOOK_FIELDS)
+        if unknown:
+            raise ValidationError({'fields': 'Unknown fields: {}. Choose among: {}.'.format(
+                ', '.join(sorted(unknown)), ', '.join(BOOK_FIELDS))})
+        expand = self.request.query_params.get('expand', 'authors')
+        if expand not in ('authors', 'none'):
+            raise ValidationError({'expand': 'Choose one of: authors, none.'})
+        fields = tuple(field for field in BOOK_FIELDS if field in requested) if requested else BOOK_FIELDS
+        return fields, expand == 'authors'
+
+    def get_values_fields(self):
+        fields, _ = self.get_representation_options()
+        return book_values(fields)
+
+    def to_representations(self, rows):
+        return book_representations(rows, *self.get_representation_options())
+
+    def get_serializer_context(self):
+        fields, expand_authors = self.get_representation_options()
+        return dict(super().get_serializer_context(), fields=fields, expand_authors=expand_authors)
 
     def get_queryset(self):
+        queryset = self.queryset
+        fields, expand_authors = self.get_representation_options()
+        if 'authors' not in fields:
+            queryset = queryset.prefetch_related(None).only(*book_values(fields))
+        elif not expand_authors:
+            queryset = queryset.prefetch_related(None).prefetch_related(
+                Prefetch('authors', queryset=Author.objects.order_by('id').only('id'))).only(*book_values(fields))
+        elif fields != BOOK_FIELDS:
+            queryset = queryset.only(*book_values(fields))
+
         query_params = self.request.query_params
-        if query_params:
-            query = {}
-            for valid_field in self.valid_fields_filter_list:
-                if query_params.get(valid_field):
-                    query[valid_field] = query_params.get(valid_field)
-            return self.queryset.filter(**query)
-        return self.queryset
+        if query_params.get(BookQuerySet.ordering_param) and self.paginator and self.paginator.use_cursor(self.request):
+            raise ValidationError(
+                {BookQuerySet.ordering_param: 'Cursor pagination only supports the default ordering.'})
+        try:
+            return queryset.filter_by_params(query_params).sort_by_params(query_params)
+        except DjangoValidationError as e:
+            raise ValidationError(e.message_dict)
+
+    @action(detail=False)
+    def export(self, request):
+        """Streams every book matching the list filters, with its authors, as NDJSON (`output=ndjson`, the default)
+        or CSV (`output=csv`). The response is gzipped on the fly when the client accepts it"""
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            raise ValidationError({'output': 'Choose one of: {}.'.format(', '.join(EXPORT_FORMATS))})
+        content_type, lines = EXPORT_FORMATS[output]
+
+        chunks = iter_chunks(lines(iter_books(self.get_queryset())))
+        use_gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        response = StreamingHttpResponse(gzip_chunks(chunks) if use_gzip else chunks, content_type=content_type)
+        if use_gzip:
+            response['Content-Encoding'] = 'gzip'
+        response['Content-Disposition'] = 'attachment; filename="books.{}"'.format(output)
+        response['Vary'] = 'Accept-Encoding'
+        return response
+
+
+def metrics(request):
+    """Serves the request metrics of every worker in the Prometheus text format, to authorized requests only"""
+    if not is_authorized(request, metrics_config()['TOKEN']):
+        raise PermissionDenied
+    return HttpResponse(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
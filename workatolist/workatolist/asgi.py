@@ -1,7 +1,8 @@
 """
 ASGI config for workatolist project.
 
-It exposes the ASGI callable as a module-level variable named ``application``.
+It exposes the ASGI callable as a module-level variable named ``application``. The books and authors read
+endpoints run on a bounded pool of threads, see books.asgi.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -9,8 +10,11 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+
+from books.asgi import AsyncReadHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'workatolist.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+application = AsyncReadHandler()
@@ -0,0 +1,7 @@
+from django.conf.urls import url
+
+from books.schema import SchemaView
+
+urlpatterns = [
+    url('', SchemaView.with_ui('swagger')),
+]
@@ -48,6 +48,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'books.middleware.InstrumentationMiddleware',
+    'books.middleware.ProfilingMiddleware',
+    'books.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,6 +60,57 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# API only mode, for the web workers and the commands that don't need the admin: leaves out the admin, which has no
+# URLs, and the sessions and messages the API doesn't use, and imports the /docs/ URLconf, with the schema generator,
+# on its first request instead of at startup. The profilestartup command reports what it saves
+LEAN_RUNTIME = os.getenv('LEAN_RUNTIME', False)
+if LEAN_RUNTIME:
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in (
+        'django.contrib.admin',
+        'django.contrib.sessions',
+        'django.contrib.messages',
+    )]
+    MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in (
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware',
+    )]
+
+# Per request SQL, serialization and render timings, sent in the Server-Timing header and aggregated by route in
+# the Prometheus /metrics endpoint. Under gunicorn, set METRICS_MULTIPROCESS_DIR to a directory shared by the workers,
+# wiped on deploys, so /metrics merges the metrics of all of them. Both reveal how the DB performs, so unless DEBUG is
+# on they are only served to requests sending `Authorization: Bearer <TOKEN>`, and to none without a TOKEN
+REQUEST_METRICS = {
+    'ENABLED': not os.getenv('DISABLE_REQUEST_METRICS', False),
+    'SERVER_TIMING': True,
+    'TOKEN': os.getenv('METRICS_TOKEN'),
+    'MULTIPROCESS_DIR': os.getenv('METRICS_MULTIPROCESS_DIR'),
+    'FLUSH_INTERVAL': 5,
+}
+
+# Opt-in profiling of a SAMPLE_RATE fraction of the requests, and of requests with a valid X-Profile-Token header
+# (see the profiletoken command). MODE is `cprofile`, writing pstats files, or `sampling`, writing collapsed stacks
+REQUEST_PROFILING = {
+    'ENABLED': os.getenv('REQUEST_PROFILING', False),
+    'SAMPLE_RATE': float(os.getenv('PROFILING_SAMPLE_RATE', 0)),
+    'MODE': os.getenv('PROFILING_MODE', 'cprofile'),
+    'DIRECTORY': os.getenv('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles')),
+    'SAMPLING_INTERVAL': 0.005,
+    'TOKEN_MAX_AGE': 3600,
+}
+
+# Under an ASGI server (see workatolist/asgi.py), GET requests to the books and authors list and detail endpoints run
+# on THREADS threads, each one with its own DB connection, with up to MAX_PENDING requests waiting for a thread.
+# Further ones get a 503 with a Retry-After header of RETRY_AFTER seconds instead of piling up behind a slow DB
+ASYNC_READS = {
+    'THREADS': int(os.getenv('ASYNC_READ_THREADS', 8)),
+    'MAX_PENDING': int(os.getenv('ASYNC_READ_MAX_PENDING', 64)),
+    'RETRY_AFTER': 1,
+}
+
+# Adds the X-Query-Count header to every response, the replaybenchmark command reports it
+QUERY_COUNT_HEADER = os.getenv('QUERY_COUNT_HEADER', False)
+
 ROOT_URLCONF = 'workatolist.urls'
 
 TEMPLATES = [
@@ -95,12 +149,79 @@ DATABASES = {
     }
 }
 
+DATABASE_ROUTERS = ['books.routers.ReplicaRouter']
+
+# Safe method requests read from the replicas when READ_FROM_REPLICAS is set. SELECTION is `round_robin` or
+# `least_lag`, among the replicas that passed their last health check, run every HEALTH_CHECK_INTERVAL seconds, and
+# lag at most MAX_LAG seconds. Clients read from the primary for PIN_SECONDS after their own writes. The replicas
+# themselves are added to DATABASES and ALIASES at the end of the settings
+DATABASE_REPLICAS = {
+    'ENABLED': os.getenv('READ_FROM_REPLICAS', False),
+    'ALIASES': [],
+    'SELECTION': os.getenv('DB_REPLICA_SELECTION', 'round_robin'),
+    'HEALTH_CHECK_INTERVAL': 5,
+    'MAX_LAG': 30,
+    'PIN_SECONDS': 10,
+}
+
+# The OpenAPI schema served by /docs/ is built once per process, or read from FILE when the buildschema command wrote
+# it at build time. A file built for another VERSION is ignored, set SOURCE_VERSION to the commit of the release (the
+# Heroku build does) so processes never serve the schema of the previous deploy. Without it, the file is stamped with
+# a hash of the API code and of the library versions instead
+OPENAPI_SCHEMA = {
+    'FILE': os.getenv('OPENAPI_SCHEMA_FILE'),
+    'VERSION': os.getenv('SOURCE_VERSION') or os.getenv('HEROKU_SLUG_COMMIT', ''),
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    'DEFAULT_PAGINATION_CLASS': 'books.pagination.LimitOffsetOrCursorPagination',
+    'DEFAULT_RENDERER_CLASSES': (
+        'books.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'PAGE_SIZE': 10
 }
 
+# Unfiltered books and authors lists of tables holding more rows than this, according to the PostgreSQL planner
+# statistics, report an estimated count instead of counting every row, unless count=exact is sent. 0 disables it
+ESTIMATED_COUNT_THRESHOLD = int(os.getenv('ESTIMATED_COUNT_THRESHOLD', 100000))
+
+# Change feed served by /books/changes/. The prunechanges command deletes the entries older than RETENTION_DAYS,
+# clients with older tokens must sync the full list again
+BOOK_CHANGES = {
+    'RETENTION_DAYS': int(os.getenv('BOOK_CHANGES_RETENTION_DAYS', 30)),
+}
+
+# Maximum number of operations accepted by each request to /books/batch/
+BOOKS_BATCH_MAX_OPERATIONS = int(os.getenv('BOOKS_BATCH_MAX_OPERATIONS', 1000))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by every worker and dyno, the createcachetable command creates its table on release. Point it to a
+    # memcached or redis server instead when the app gets one
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'books_response_cache',
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 10000))},
+    },
+}
+
+# Cache for the books and authors read endpoints, kept in the `responses` cache so the invalidations made by a worker
+# or a management command reach every process. Entries expire after TIMEOUT seconds. RESPONSE_CACHE_LOCAL switches to
+# an LRU cache in the memory of each process, which serves hits without a round trip but only sees the invalidations
+# of its own process: others keep serving invalidated responses until they expire
+RESPONSE_CACHE = {
+    'BACKEND': 'books.cache.DjangoCacheBackend',
+    'OPTIONS': {'alias': 'responses'},
+    'TIMEOUT': int(os.getenv('RESPONSE_CACHE_TIMEOUT', 30)),
+}
+if os.getenv('RESPONSE_CACHE_LOCAL'):
+    RESPONSE_CACHE.update(BACKEND='books.cache.LocMemLRUBackend', OPTIONS={
+        'max_entries': int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1024))})
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -141,3 +262,16 @@ STATIC_URL = '/static/'
 
 # This takes care of the Heroku settings
 django_heroku.settings(locals())
+
+# Read replicas, one per host listed in DB_REPLICA_HOSTS, sharing the name and credentials of the primary. They are
+# copied from the primary once django_heroku replaced it with the DB of DATABASE_URL. Tests get a separate database
+# for each of them
+for number, host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    alias = 'replica_{}'.format(number)
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host, TEST={'NAME': 'test_{}_{}'.format(
+        DATABASES['default']['NAME'], alias)})
+    DATABASE_REPLICAS['ALIASES'].append(alias)
+
+# django_heroku puts WhiteNoise first, the instrumentation goes back in front of it so it measures the whole request
+MIDDLEWARE = ['books.middleware.InstrumentationMiddleware'] + [
+    middleware for middleware in MIDDLEWARE if middleware != 'books.middleware.InstrumentationMiddleware']
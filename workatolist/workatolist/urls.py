@@ -1,20 +1,20 @@
-from django.conf.urls import url
-from django.urls import path, include
+from django.conf import settings
+from django.urls import URLResolver, path, include
+from django.urls.resolvers import RegexPattern
 
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
 from rest_framework import routers
 
 from books import views
 
 
-schema_view = get_schema_view(
-   openapi.Info(
-      title="Work At Olist API",
-      default_version='v1',
-   ),
-   public=True
-)
+def lazy_include(regex, urlconf_name):
+    """Like include(), but with LEAN_RUNTIME the URLconf is only imported once a request resolves under it"""
+    resolver = URLResolver(RegexPattern(regex), urlconf_name)
+    if not settings.LEAN_RUNTIME:
+        # Imported right away, like include() does
+        resolver.url_patterns
+    return resolver
+
 
 router = routers.DefaultRouter()
 router.register(r'authors', views.AuthorViewSet, basename='authors')
@@ -22,5 +22,6 @@ router.register(r'books', views.BookViewSet, basename='books')
 
 urlpatterns = [
     path('', include(router.urls)),
-    url('docs/', schema_view.with_ui('swagger'))
+    path('metrics', views.metrics),
+    lazy_include('docs/', 'workatolist.docs_urls'),
 ]